@@ -0,0 +1,144 @@
+import asyncio
+from typing import *
+
+from .computer import (
+  BaseComputer,
+  InputRequired,
+  InvalidOpCode,
+  State,
+)
+
+
+def _queue_contents(q: asyncio.Queue) -> Tuple[int, ...]:
+  items = []
+  while True:
+    try:
+      items.append(q.get_nowait())
+      q.task_done()
+    except asyncio.QueueEmpty:
+      break
+
+  for item in items:
+    q.put_nowait(item)
+  return tuple(items)
+
+
+def _refill_queue(q: asyncio.Queue, items: Sequence[int]):
+  while True:
+    try:
+      q.get_nowait()
+      q.task_done()
+    except asyncio.QueueEmpty:
+      break
+
+  for item in items:
+    q.put_nowait(item)
+
+
+class Computer(BaseComputer):
+  """
+  Intcode computer run as an asyncio task.
+
+  The computer runs about `SLICE_STEPS` instructions before yielding to the
+  event loop, so many computers can share a single loop.
+
+  """
+  SLICE_STEPS = 1000
+
+  def __init__(self, memory: Optional[List[int]] = None, input_queue=None, output_queue=None,
+               compiled: bool = False):
+    self.compiled = compiled
+    self.reset()
+    self.init_memory(memory)
+
+    if input_queue is not None:
+      self.input_queue = input_queue
+    else:
+      self.input_queue = asyncio.Queue()
+
+    if output_queue is not None:
+      self.output_queue = output_queue
+    else:
+      self.output_queue = asyncio.Queue()
+
+    self.finished_event = asyncio.Event()
+
+  def reset(self):
+    self.ip = 0
+    self.rel_base = 0
+
+  async def send(self, value: int):
+    """
+    Send a value into the computer.
+
+    """
+    await self.input_queue.put(value)
+
+  async def recv(self) -> int:
+    """
+    Get an output value from the computer.
+
+    """
+    return await self.output_queue.get()
+
+  async def wait_finished(self):
+    """
+    Wait for the program to exit.
+
+    """
+    await self.finished_event.wait()
+
+  def pending_io(self) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    return (
+      _queue_contents(self.input_queue), _queue_contents(self.output_queue))
+
+  def set_pending_io(self, inputs: Sequence[int], outputs: Sequence[int]):
+    _refill_queue(self.input_queue, inputs)
+    _refill_queue(self.output_queue, outputs)
+
+  def run_slice(self, input_fn, output_fn) -> State:
+    """
+    Run about `SLICE_STEPS` instructions, through the same run loops as
+    `execute`, so tracing, profiling and compiling all apply.
+
+    """
+    return self.execute(input_fn, output_fn, self.SLICE_STEPS)
+
+  async def run(self):
+    # Input taken from the queue while the computer was blocked.
+    held = []
+
+    def input_fn():
+      if held:
+        return held.pop()
+      try:
+        value = self.input_queue.get_nowait()
+      except asyncio.QueueEmpty:
+        raise InputRequired()
+      self.input_queue.task_done()
+      return value
+
+    try:
+      while True:
+        state = self.run_slice(input_fn, self.output_queue.put_nowait)
+        if state is State.HALTED:
+          break
+        elif state is State.NEEDS_INPUT:
+          held.append(await self.input_queue.get())
+          self.input_queue.task_done()
+        else:
+          # Let other computers run.
+          await asyncio.sleep(0)
+
+    except InvalidOpCode as e:
+      print(str(e))
+      return
+
+    self.finished_event.set()
+
+  def start(self) -> asyncio.Task:
+    """
+    Schedule the computer to run on the current event loop.
+
+    """
+    return asyncio.ensure_future(self.run())
@@ -1,78 +1,54 @@
-import dataclasses
-import enum
+import collections
+import copy
+import itertools
 import queue
 import threading
 from typing import *
 
+from .computer import (
+  BaseComputer,
+  ComputerError,
+  InputRequired,
+  InvalidAddress,
+  InvalidMemoryMode,
+  InvalidOpCode,
+  OPERATIONS,
+  Operation,
+  ProgramFinished,
+  Snapshot,
+  State,
+)
 
-class ComputerError(Exception):
-  """
-  Base class for computer error exceptions.
-
-  """
-
-
-class InvalidOpCode(ComputerError):
-  """
-  Exception raised when computer encounters invalid opcode.
-
-  """
-  pass
 
+def _queue_contents(q: queue.Queue) -> Tuple[int, ...]:
+  with q.mutex:
+    return tuple(q.queue)
 
-class InvalidMemoryMode(ComputerError):
-  """
-  Exception raised when computer hits an invalid memory mode.
-
-  """
-  pass
-
-
-class InvalidAddress(ComputerError):
-  """
-  Exception raised when computer tries to use invalid memory address.
-
-  """
-  pass
-
-
-class ProgramFinished(Exception):
-  """
-  Exception raised when program has finished successfully.
-
-  """
-  pass
-
-
-@dataclasses.dataclass
-class Operation:
-  code: int
-  name: str
-  params: int
 
+def _refill_queue(q: queue.Queue, items: Sequence[int]):
+  while True:
+    try:
+      q.get_nowait()
+      q.task_done()
+    except queue.Empty:
+      break
 
-OPERATIONS = {
-  1: Operation(1, "add", 3),
-  2: Operation(2, "multiply", 3),
-  3: Operation(3, "input", 1),
-  4: Operation(4, "output", 1),
-  5: Operation(5, "jump-if-true", 2),
-  6: Operation(6, "jump-if-false", 2),
-  7: Operation(7, "less-than", 3),
-  8: Operation(8, "equals", 3),
-  9: Operation(9, "adjust-rel-base", 1),
-  99: Operation(99, "exit", 0),
-}
+  for item in items:
+    q.put(item)
 
 
-class Computer:
+class Computer(BaseComputer):
   """
   Intcode computer.
 
   """
-  MEMSIZE = 2 ** 16
+  # Set by subclasses which override `step`, so that `run` calls it for
+  # every instruction instead of using the faster run loops.
+  stepped = False
 
-  def __init__(self, memory: Optional[List[int]] = None, input_queue=None, output_queue=None):
+  def __init__(self, memory: Optional[List[int]] = None, input_queue=None, output_queue=None,
+               compiled: bool = False):
+    self.compiled = compiled
     self.reset()
     self.init_memory(memory)
 
@@ -92,16 +68,6 @@ class Computer:
     self.ip = 0
     self.rel_base = 0
 
-  def init_memory(self, memory: Optional[List[int]] = None):
-    self.memory = [0] * self.MEMSIZE
-    if memory is not None:
-      assert len(memory) < self.MEMSIZE
-      self.memory[:len(memory)] = memory[:]
-
-  def init_memory_from_string(self, memory: str):
-    int_mem = [int(x) for x in memory.split(",")]
-    self.init_memory(int_mem)
-
   def send(self, value: int, block=True, timeout=None):
     """
     Send a value into the computer.
@@ -116,131 +82,150 @@ class Computer:
     """
     return self.output_queue.get(block=block, timeout=timeout)
 
-  @staticmethod
-  def opdata_to_opcode(opdata):
-      return opdata % 100
+  def pending_io(self) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    return (
+      _queue_contents(self.input_queue), _queue_contents(self.output_queue))
 
-  @staticmethod
-  def get_memory_mode(opdata, position):
-    return (opdata // 10 ** (position + 1)) % 10
+  def set_pending_io(self, inputs: Sequence[int], outputs: Sequence[int]):
+    _refill_queue(self.input_queue, inputs)
+    _refill_queue(self.output_queue, outputs)
 
-  def get_param_val(self, opdata, param_pos, param, input_param=True):
-    memory_mode = self.get_memory_mode(opdata, param_pos)
+  def fork(self, share_profile: bool = False) -> "Computer":
+    """
+    Return an independent copy of the computer, with its own queues.
 
-    if memory_mode == 0:
-      # Position mode.
-      addr = param
+    The computer should not be running, or should be blocked waiting for
+    input, when it is forked. The copy is not started. See
+    `BaseComputer.fork` for `share_profile`.
 
-    elif memory_mode == 1:
-      # Immediate mode.
-      return param
+    """
+    snapshot = self.snapshot()
+    clone = copy.copy(self)
+    clone.detach(share_profile)
+    clone.input_queue = queue.Queue()
+    clone.output_queue = queue.Queue()
+    clone.finished_event = threading.Event()
+    if self.finished_event.is_set():
+      clone.finished_event.set()
+    clone.restore(snapshot)
+    return clone
+
+  def get_input(self) -> int:
+    value = self.input_queue.get()
+    self.input_queue.task_done()
+    return value
+
+  def get_input_nowait(self) -> int:
+    try:
+      value = self.input_queue.get_nowait()
+    except queue.Empty:
+      raise InputRequired()
+    self.input_queue.task_done()
+    return value
 
-    elif memory_mode == 2:
-      # Relative mode.
-      addr = param + self.rel_base
+  def step(self):
+    super().step(self.get_input, self.output_queue.put)
 
-    else:
-      # Invalid mode.
-      raise InvalidMemoryMode(memory_mode, opdata, param)
-    
-    if addr < 0:
-      raise InvalidAddress("Address negative", addr)
+  def run(self, max_steps: Optional[int] = None) -> Optional[State]:
+    """
+    Run the program, returning why it stopped.
 
+    Without `max_steps`, runs until the program exits, blocking whenever it
+    waits for input. With `max_steps`, never blocks: returns
+    `State.NEEDS_INPUT` if the input queue is empty when input is needed,
+    or `State.BUDGET_EXHAUSTED` after about `max_steps` instructions. The
+    computer can be run again to carry on.
+
+    """
     try:
-      if input_param:
-        return self.memory[addr]
-      else:
-        return addr
-    except KeyError:
-      raise InvalidAddress("Address out of range", addr)
+      if max_steps is not None:
+        state = self.execute(
+          self.get_input_nowait, self.output_queue.put, max_steps)
+        if state is State.HALTED:
+          self.finished_event.set()
+        return state
+
+      if self.stepped:
+        while True:
+          self.step()
+
+      self.run_loop()(self.get_input, self.output_queue.put)
+      self.finished_event.set()
+      return State.HALTED
 
-  def step(self):
-    opdata = self.memory[self.ip]
-    op = OPERATIONS[self.opdata_to_opcode(opdata)]
-    params = [self.memory[self.ip + i + 1] for i in range(op.params)]
-
-    #print(opdata, params)
-
-    if op.code == 1:
-      # Add
-      output_addr = self.get_param_val(opdata, 3, params[2], input_param=False)
-      self.memory[output_addr] = (
-        self.get_param_val(opdata, 1, params[0]) +
-        self.get_param_val(opdata, 2, params[1]))
-
-    elif op.code == 2:
-      # Multiply
-      output_addr = self.get_param_val(opdata, 3, params[2], input_param=False)
-      self.memory[output_addr] = (
-        self.get_param_val(opdata, 1, params[0]) *
-        self.get_param_val(opdata, 2, params[1]))
-
-    elif op.code == 3:
-      # Input
-      output_addr = self.get_param_val(opdata, 1, params[0], input_param=False)
-      self.memory[output_addr] = self.input_queue.get()
-      self.input_queue.task_done()
-
-    elif op.code == 4:
-      # Output
-      output_val = self.get_param_val(opdata, 1, params[0])
-      self.output_queue.put(output_val)
-  
-    elif op.code == 5:
-      # Jump if true
-      if self.get_param_val(opdata, 1, params[0]) != 0:
-        self.ip = self.get_param_val(opdata, 2, params[1])
-        # Don't increment IP
-        return
+    except ProgramFinished:
+      self.finished_event.set()
+      return State.HALTED
 
-    elif op.code == 6:
-      # Jump if false
-      if self.get_param_val(opdata, 1, params[0]) == 0:
-        self.ip = self.get_param_val(opdata, 2, params[1])
-        # Don't increment IP
-        return
+    except InvalidOpCode as e:
+      print(str(e))
 
-    elif op.code == 7:
-      # Less than
-      output_addr = self.get_param_val(opdata, 3, params[2], input_param=False)
-      if self.get_param_val(opdata, 1, params[0]) < self.get_param_val(opdata, 2, params[1]):
-        self.memory[output_addr] = 1
-      else:
-        self.memory[output_addr] = 0
-
-    elif op.code == 8:
-      # Equals
-      output_addr = self.get_param_val(opdata, 3, params[2], input_param=False)
-      if self.get_param_val(opdata, 1, params[0]) == self.get_param_val(opdata, 2, params[1]):
-        self.memory[output_addr] = 1
-      else:
-        self.memory[output_addr] = 0
-
-    elif op.code == 9:
-      # Change relative base.
-      self.rel_base += self.get_param_val(opdata, 1, params[0])
-      assert self.rel_base >= 0
-
-    elif op.code == 99:
-      # Abort
+  def take_queued_inputs(self) -> List[int]:
+    """
+    Remove and return everything waiting on the input queue.
+
+    """
+    values = []
+    while True:
+      try:
+        values.append(self.input_queue.get_nowait())
+        self.input_queue.task_done()
+      except queue.Empty:
+        return values
+
+  def run_until_blocked(
+      self, inputs: Iterable[int] = ()) -> Tuple[List[int], State]:
+    """
+    Run in the calling thread until the program exits or needs more input.
+
+    Inputs already sent to the input queue are used before `inputs`.
+
+    """
+    outputs, state = super().run_until_blocked(
+      itertools.chain(self.take_queued_inputs(), inputs))
+    if state is State.HALTED:
       self.finished_event.set()
-      raise ProgramFinished()
+    return outputs, state
 
-    else:
-      raise InvalidOpCode("Invalid op code: {}".format(op.code))
+  def run_generator(
+      self, inputs: Iterable[int] = ()
+  ) -> Generator[Optional[int], Optional[int], None]:
+    """
+    Run the computer in the calling thread as a generator.
 
-    self.ip += 1 + op.params
+    Yields each output value in turn. When the computer needs input and
+    none is buffered, yields None; the next input is passed back in with
+    `send()`. Any value sent in at an output is buffered as input too.
 
-  def run(self):
-    try:
-      while True:
-        self.step()
+    The generator finishes when the program exits. Inputs already sent to
+    the input queue are used before `inputs`.
 
-    except ProgramFinished:
-      pass
+    """
+    pending = collections.deque(self.take_queued_inputs())
+    pending.extend(inputs)
 
-    except InvalidOpCode as e:
-      print(str(e))
+    def input_fn():
+      if pending:
+        return pending.popleft()
+      raise InputRequired()
+
+    outputs = collections.deque()
+    while True:
+      state = self.execute(input_fn, outputs.append)
+
+      while outputs:
+        value = yield outputs.popleft()
+        if value is not None:
+          pending.append(value)
+
+      if state is State.HALTED:
+        self.finished_event.set()
+        return
+
+      while not pending:
+        value = yield None
+        if value is not None:
+          pending.append(value)
 
   def run_async(self):
     run_thread = threading.Thread(target=self.run)
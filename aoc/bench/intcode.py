@@ -0,0 +1,516 @@
+"""
+Benchmarks of the Intcode engines on every Intcode puzzle input.
+
+Each puzzle has a scripted, deterministic driver which plays it through
+from a fixed set of inputs. Each driver is run on each engine, recording:
+
+  wall_time               best time of `--repeat` runs, in seconds
+  instructions            Intcode instructions executed
+  instructions_per_second instructions / wall_time
+  peak_memory             peak bytes allocated during a run, unless
+                          skipped with --no-memory
+  inputs, outputs         I/O operations
+
+Instruction and I/O counts come from a separate profiled run, so they
+don't slow the timed runs. Results can be saved as JSON and compared
+against an earlier run:
+
+  python -m aoc.bench.intcode --output new.json --compare old.json
+
+Run from the root of the repository, so the puzzle inputs can be found.
+
+"""
+import argparse
+import collections
+import itertools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from typing import *
+
+from .. import async_computer
+from .. import computer
+from .. import program
+from .. import profiler
+from .. import seventeen
+from .. import twentyfive
+from .. import twentyone
+from .. import utils
+
+
+__all__ = (
+  "DRIVERS",
+  "ENGINES",
+  "SteppedComputer",
+  "compare",
+  "count_instructions",
+  "format_comparison",
+  "format_results",
+  "run_benchmark",
+  "run_benchmarks",
+)
+
+
+# Version of the JSON results format.
+RESULTS_VERSION = 1
+
+
+class SteppedComputer(async_computer.Computer):
+  """
+  Async computer run one `step` at a time, with I/O through its queues.
+
+  This is the path its threaded `run` takes for subclasses which override
+  `step`, but in the calling thread and stopping when no input is queued.
+
+  """
+  def get_input(self) -> int:
+    return self.get_input_nowait()
+
+  def run_until_blocked(
+      self, inputs: Iterable[int] = ()) -> Tuple[List[int], computer.State]:
+    for value in inputs:
+      self.send(value)
+
+    try:
+      while True:
+        self.step()
+    except computer.InputRequired:
+      state = computer.State.NEEDS_INPUT
+    except computer.ProgramFinished:
+      self.finished_event.set()
+      state = computer.State.HALTED
+
+    outputs = []
+    while not self.output_queue.empty():
+      outputs.append(self.output_queue.get())
+    return outputs, state
+
+
+# Engines to benchmark. Each creates a computer from a program's memory;
+# drivers only use `run_until_blocked` and `memory`.
+ENGINES = {
+  "interpreter": lambda memory: computer.Computer(memory),
+  "compiled": lambda memory: computer.Computer(memory, compiled=True),
+  "async": lambda memory: SteppedComputer(memory),
+}
+
+
+# A driver plays a puzzle through. It is passed a function which starts a
+# new computer running the puzzle's program, with the given cells of memory
+# patched first, and returns a result to check the engines agree.
+Start = Callable[..., computer.BaseComputer]
+
+
+def _drive_2(start: Start):
+  c = start({1: 12, 2: 2})
+  c.run_until_blocked()
+  return c.memory[0]
+
+
+def _drive_5(start: Start):
+  return [start().run_until_blocked([system])[0][-1] for system in (1, 5)]
+
+
+# Number of phase settings tried for each part of day 7. Every run starts
+# new computers, which is costly for engines with a large start-up cost, so
+# only a sample are tried.
+_DAY_7_PHASES = 24
+
+
+def _drive_7(start: Start):
+  best_a = 0
+  for phases in itertools.islice(
+      itertools.permutations(range(5)), _DAY_7_PHASES):
+    signal = 0
+    for phase in phases:
+      signal = start().run_until_blocked([phase, signal])[0][-1]
+    best_a = max(best_a, signal)
+
+  best_b = 0
+  for phases in itertools.islice(
+      itertools.permutations(range(5, 10)), _DAY_7_PHASES):
+    amps = [start() for _ in phases]
+    for amp, phase in zip(amps, phases):
+      amp.run_until_blocked([phase])
+    signals = [0]
+    state = computer.State.NEEDS_INPUT
+    while state is computer.State.NEEDS_INPUT:
+      for amp in amps:
+        signals, state = amp.run_until_blocked(signals)
+    best_b = max(best_b, signals[-1])
+
+  return [best_a, best_b]
+
+
+def _drive_9(start: Start):
+  return [start().run_until_blocked([mode])[0][-1] for mode in (1, 2)]
+
+
+def _drive_11(start: Start):
+  c = start()
+  white = set()
+  painted = set()
+  pos = 0j
+  direction = 1j
+  _, state = c.run_until_blocked()
+  while state is computer.State.NEEDS_INPUT:
+    (colour, turn), state = c.run_until_blocked([int(pos in white)])
+    if colour:
+      white.add(pos)
+    else:
+      white.discard(pos)
+    painted.add(pos)
+    direction *= -1j if turn else 1j
+    pos += direction
+  return len(painted)
+
+
+def _drive_13(start: Start):
+  outputs, _ = start().run_until_blocked()
+  blocks = outputs[2::3].count(2)
+
+  c = start({0: 2})
+  ball = paddle = score = 0
+  outputs, state = c.run_until_blocked()
+  while True:
+    for i in range(0, len(outputs), 3):
+      x, y, tile = outputs[i:i + 3]
+      if x == -1:
+        score = tile
+      elif tile == 3:
+        paddle = x
+      elif tile == 4:
+        ball = x
+    if state is not computer.State.NEEDS_INPUT:
+      break
+    outputs, state = c.run_until_blocked([(ball > paddle) - (ball < paddle)])
+
+  return [blocks, score]
+
+
+# Day 15 moves, as (dx, dy), and the move which undoes each.
+_MOVES = {1: (0, 1), 2: (0, -1), 3: (-1, 0), 4: (1, 0)}
+_BACK = {1: 2, 2: 1, 3: 4, 4: 3}
+
+
+def _drive_15(start: Start):
+  c = start()
+  pos = (0, 0)
+  seen = {pos}
+  path = []
+  untried = [[1, 2, 3, 4]]
+  o2_depth = None
+  # Depth-first search of the whole maze, backtracking the droid.
+  while untried:
+    if not untried[-1]:
+      untried.pop()
+      if path:
+        move = path.pop()
+        c.run_until_blocked([_BACK[move]])
+        dx, dy = _MOVES[move]
+        pos = (pos[0] - dx, pos[1] - dy)
+      continue
+
+    move = untried[-1].pop()
+    dx, dy = _MOVES[move]
+    target = (pos[0] + dx, pos[1] + dy)
+    if target in seen:
+      continue
+    seen.add(target)
+
+    (status,), _ = c.run_until_blocked([move])
+    if status == 0:
+      continue
+    if status == 2:
+      o2_depth = len(path) + 1
+    pos = target
+    path.append(move)
+    untried.append([1, 2, 3, 4])
+
+  return [len(seen), o2_depth]
+
+
+def _drive_17(start: Start):
+  outputs, _ = start().run_until_blocked()
+  scaffold = outputs.count(ord("#"))
+
+  inputs = [ord(char)
+            for line in seventeen.MOVEMENT_ROUTINE for char in line + "\n"]
+  outputs, _ = start({0: 2}).run_until_blocked(inputs)
+  return [scaffold, outputs[-1]]
+
+
+def _drive_19(start: Start):
+  # A sample of the part A grid, with a new computer for every point.
+  return sum(start().run_until_blocked([x, y])[0][0]
+             for y in range(0, 50, 5) for x in range(0, 50, 5))
+
+
+def _drive_21(start: Start):
+  results = []
+  for script in (twentyone.WALK_SCRIPT, twentyone.RUN_SCRIPT):
+    inputs = [ord(char) for line in script for char in line + "\n"]
+    results.append(start().run_until_blocked(inputs)[0][-1])
+  return results
+
+
+def _drive_23(start: Start):
+  nics = [start() for _ in range(50)]
+  queues = [collections.deque([addr]) for addr in range(50)]
+  while True:
+    for addr, nic in enumerate(nics):
+      inputs = list(queues[addr]) or [-1]
+      queues[addr].clear()
+      outputs, _ = nic.run_until_blocked(inputs)
+      for i in range(0, len(outputs), 3):
+        dest, x, y = outputs[i:i + 3]
+        if dest == 255:
+          return y
+        queues[dest].extend((x, y))
+
+
+def _drive_25(start: Start):
+  c = start()
+  outputs, _ = c.run_until_blocked()
+  total = len(outputs)
+  for command in twentyfive.CHECKPOINT_COMMANDS:
+    outputs, _ = c.run_until_blocked(ord(char) for char in command + "\n")
+    total += len(outputs)
+  return total
+
+
+# Drivers for each Intcode puzzle, by day.
+DRIVERS = {
+  2: _drive_2,
+  5: _drive_5,
+  7: _drive_7,
+  9: _drive_9,
+  11: _drive_11,
+  13: _drive_13,
+  15: _drive_15,
+  17: _drive_17,
+  19: _drive_19,
+  21: _drive_21,
+  23: _drive_23,
+  25: _drive_25,
+}
+
+
+def _starter(image: program.ProgramImage, engine: Callable) -> Start:
+  def start(patches: Optional[Dict[int, int]] = None):
+    memory = image
+    if patches:
+      memory = list(image.values)
+      for addr, value in patches.items():
+        memory[addr] = value
+    return engine(memory)
+  return start
+
+
+def _counting_engine(profile: profiler.Profile) -> Callable:
+  def engine(memory):
+    c = computer.Computer(memory)
+    c.enable_profiling(profile)
+    return c
+  return engine
+
+
+def count_instructions(day: int) -> Tuple[profiler.Profile, Any]:
+  """
+  Run the driver for `day`, profiling the instructions and I/O it takes.
+
+  Returns the profile and the driver's result.
+
+  """
+  image = program.load_program(utils.load_input(day))
+  profile = profiler.Profile()
+  result = DRIVERS[day](_starter(image, _counting_engine(profile)))
+  return profile, result
+
+
+def run_benchmark(
+    day: int,
+    engine: str,
+    repeat: int = 3,
+    counts: Optional[Tuple[profiler.Profile, Any]] = None,
+    memory: bool = True) -> Dict[str, Any]:
+  """
+  Benchmark the driver for `day` on `engine`.
+
+  `counts` is the result of `count_instructions`, if already taken. Peak
+  memory is only measured if `memory` is set, as tracing allocations slows
+  the run down several times over.
+
+  """
+  if counts is None:
+    counts = count_instructions(day)
+  profile, expected = counts
+
+  image = program.load_program(utils.load_input(day))
+  driver = DRIVERS[day]
+  start = _starter(image, ENGINES[engine])
+  wall_time = float("inf")
+  for _ in range(repeat):
+    began = time.perf_counter()
+    result = driver(start)
+    wall_time = min(wall_time, time.perf_counter() - began)
+
+  peak_memory = None
+  if memory:
+    tracemalloc.start()
+    try:
+      driver(start)
+      _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+      tracemalloc.stop()
+
+  return {
+    "wall_time": wall_time,
+    "instructions": profile.instructions,
+    "instructions_per_second": profile.instructions / wall_time,
+    "peak_memory": peak_memory,
+    "inputs": profile.inputs,
+    "outputs": profile.outputs,
+    "result": result,
+    "correct": result == expected,
+  }
+
+
+def run_benchmarks(
+    days: Iterable[int] = DRIVERS,
+    engines: Iterable[str] = ENGINES,
+    repeat: int = 3,
+    memory: bool = True,
+    log: Optional[TextIO] = None) -> Dict[str, Any]:
+  """
+  Benchmark each of `days` on each of `engines`.
+
+  Returns the results in the format saved as JSON.
+
+  """
+  engines = list(engines)
+  results = {engine: {} for engine in engines}
+  for day in days:
+    counts = count_instructions(day)
+    for engine in engines:
+      if log is not None:
+        print("Day {} on {}...".format(day, engine), file=log, flush=True)
+      results[engine][str(day)] = run_benchmark(
+        day, engine, repeat, counts, memory)
+
+  return {
+    "version": RESULTS_VERSION,
+    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "python": platform.python_version(),
+    "implementation": platform.python_implementation(),
+    "platform": platform.platform(),
+    "repeat": repeat,
+    "results": results,
+  }
+
+
+def format_results(report: Dict[str, Any]) -> str:
+  lines = ["{:<12} {:>4} {:>10} {:>12} {:>14} {:>10} {:>8}".format(
+    "Engine", "Day", "Time (s)", "Instructions", "Instr/sec", "Peak KiB",
+    "I/O")]
+  for engine, days in report["results"].items():
+    for day, r in days.items():
+      peak = r["peak_memory"]
+      lines.append("{:<12} {:>4} {:>10.4f} {:>12} {:>14.0f} {:>10} {:>8}{}".format(
+        engine, day, r["wall_time"], r["instructions"],
+        r["instructions_per_second"],
+        "-" if peak is None else "{:.0f}".format(peak / 1024),
+        r["inputs"] + r["outputs"],
+        "" if r["correct"] else "  WRONG RESULT"))
+  return "\n".join(lines)
+
+
+def compare(
+    old: Dict[str, Any],
+    new: Dict[str, Any],
+    threshold: float = 10.0) -> List[Dict[str, Any]]:
+  """
+  Compare the benchmarks two runs have in common.
+
+  Returns an entry for each, with the percentage change in throughput and
+  whether it dropped by more than `threshold` percent.
+
+  """
+  changes = []
+  for engine, days in new["results"].items():
+    for day, r in days.items():
+      before = old["results"].get(engine, {}).get(day)
+      if before is None:
+        continue
+      change = 100 * (
+        r["instructions_per_second"] / before["instructions_per_second"] - 1)
+      changes.append({
+        "engine": engine,
+        "day": day,
+        "old": before["instructions_per_second"],
+        "new": r["instructions_per_second"],
+        "change": change,
+        "regression": change < -threshold,
+      })
+  return changes
+
+
+def format_comparison(changes: List[Dict[str, Any]]) -> str:
+  lines = ["{:<12} {:>4} {:>14} {:>14} {:>9}".format(
+    "Engine", "Day", "Old instr/sec", "New instr/sec", "Change")]
+  for c in changes:
+    lines.append("{:<12} {:>4} {:>14.0f} {:>14.0f} {:>+8.1f}%{}".format(
+      c["engine"], c["day"], c["old"], c["new"], c["change"],
+      "  REGRESSION" if c["regression"] else ""))
+  return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+  parser = argparse.ArgumentParser(
+    prog="python -m aoc.bench.intcode",
+    description="Benchmark the Intcode engines on the puzzle inputs.")
+  parser.add_argument(
+    "--days", type=int, nargs="+", choices=sorted(DRIVERS),
+    default=sorted(DRIVERS), help="puzzles to run (default: all)")
+  parser.add_argument(
+    "--engines", nargs="+", choices=sorted(ENGINES), default=list(ENGINES),
+    help="engines to run (default: all)")
+  parser.add_argument(
+    "--repeat", type=int, default=3,
+    help="timed runs of each benchmark; the best is kept (default: 3)")
+  parser.add_argument(
+    "--no-memory", action="store_true",
+    help="don't measure peak memory, which takes an extra, slow run")
+  parser.add_argument("--output", help="save the results as JSON")
+  parser.add_argument(
+    "--compare", metavar="JSON", help="results of an earlier run to compare")
+  parser.add_argument(
+    "--threshold", type=float, default=10.0,
+    help="percentage drop in throughput counted as a regression "
+         "(default: 10)")
+  args = parser.parse_args(argv)
+
+  report = run_benchmarks(
+    args.days, args.engines, args.repeat, not args.no_memory, sys.stderr)
+  print(format_results(report))
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(report, f, indent=2)
+
+  if args.compare:
+    with open(args.compare) as f:
+      old = json.load(f)
+    changes = compare(old, report, args.threshold)
+    print()
+    print(format_comparison(changes))
+    if any(c["regression"] for c in changes):
+      return 1
+
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,454 @@
+"""
+Compiler from Intcode basic blocks to Python functions.
+
+A block starts at a given IP and runs up to and including the next jump or
+exit instruction, or up to the next input instruction. Each block is turned into Python source with operand modes
+and constant addresses resolved, then compiled with `compile()`.
+
+Every generated function has the signature:
+
+  block(c, pages, owned, mem, code, input_fn, output_fn) -> Optional[int]
+
+where `c` is the computer, `pages`, `owned` and `mem` come from its
+`PagedMemory` and `code` is its set of code cells. It returns the IP to
+continue from, or None if the program exited.
+
+Code is only compiled once it has run enough to repay the cost of compiling
+it; until then each block is interpreted. Compiled blocks are kept in a
+`BlockCache`. Computers running the same
+program image share one, so each block is only compiled once however many
+computers run it.
+
+Programs often patch the operands of their own instructions, to index
+arrays for example. Once an operand cell is seen to be written to, blocks
+are compiled to read it from memory when they run, instead of having its
+value compiled in, so patching it doesn't stop the block or recompile it.
+
+"""
+import collections
+import operator
+from typing import *
+
+from . import computer
+from .memory import PAGE_BITS, PAGE_MASK
+
+
+__all__ = (
+  "BlockCache",
+  "compile_block",
+  "shared_cache",
+)
+
+
+# Longest run of instructions compiled into a single block.
+MAX_BLOCK_LENGTH = 256
+
+# Number of instructions the computers sharing a cache interpret from the
+# start of a block before it's compiled. Compiling a block costs about as
+# much as interpreting a hundred instructions, so code which only runs a few
+# times isn't compiled.
+COMPILE_AFTER = 50
+
+# Number of times a block can be invalidated by changes to its op codes
+# before falling back to the interpreter for that IP.
+MAX_RECOMPILES = 8
+
+ARGS = "c, pages, owned, mem, code, input_fn, output_fn"
+
+# Op codes of the instructions which end a block.
+ENDS_BLOCK = frozenset((5, 6, 99))
+
+# Op codes of the instructions which start a block. A computer waiting for
+# input resumes at the input instruction, so this keeps it from compiling a
+# new block for each place it waits.
+STARTS_BLOCK = frozenset((3,))
+
+# Op codes of the instructions which write to their last operand.
+WRITERS = frozenset((1, 2, 3, 7, 8))
+
+
+def _load(mem, addr):
+  if addr < 0:
+    raise computer.InvalidAddress("Address negative", addr)
+  return mem[addr]
+
+
+def _store(mem, addr, value):
+  if addr < 0:
+    raise computer.InvalidAddress("Address negative", addr)
+  mem[addr] = value
+
+
+def _interpret(c, pages, owned, mem, code, input_fn, output_fn):
+  try:
+    computer.BaseComputer.step(c, input_fn, output_fn)
+  except computer.ProgramFinished:
+    return None
+  return c.ip
+
+
+_interpret.end = 0
+_interpret.length = 1
+_interpret.cells = {}
+_interpret.operands = frozenset()
+_interpret.pages = frozenset()
+_interpret.reads = frozenset()
+_interpret.checks = ()
+
+
+class BlockCache:
+  """
+  Compiled blocks for one program, shared by the computers running it.
+
+  A block is only used by a computer whose memory holds the values the
+  block was compiled from. If the cache belongs to a program image, it only
+  holds blocks compiled from the image's values, so a computer which still
+  shares the image's pages can use them without checking any cells.
+
+  """
+  def __init__(self, image=None):
+    self.image = image
+    self.blocks = {}
+    # Instructions interpreted from each start, to find hot blocks.
+    self.interpreted = collections.Counter()
+    # Starts of every block compiled for the cache which compiled in each
+    # cell, so a computer finds the blocks a write affects without a scan.
+    self.covering = {}
+    # Operand cells the program has been seen to write to, which blocks
+    # read from memory rather than compiling in.
+    self.volatile = set()
+
+  def usable(self, block: Callable, memory) -> bool:
+    """
+    Return whether `block` is valid for `memory`.
+
+    """
+    pages = memory.pages
+    if not all(page in pages for page in block.reads):
+      return False
+
+    if self.image is not None:
+      image_pages = self.image.memory.pages
+      if all(pages.get(page) is image_pages.get(page)
+             for page in block.pages):
+        return True
+
+    return all(page in pages and get(pages[page]) == values
+               for page, get, values in block.checks)
+
+  def get(self, c, ip: int) -> Callable:
+    """
+    Return a block starting at `ip` which is valid for computer `c`,
+    compiling it if there isn't one.
+
+    """
+    block = self.blocks.get(ip)
+    if block is not None and self.usable(block, c.memory):
+      return block
+
+    block = compile_block(c, ip, self)
+    for addr in block.cells:
+      self.covering.setdefault(addr, set()).add(ip)
+    if self.image is None or all(
+        self.image.memory[addr] == value
+        for addr, value in block.cells.items()):
+      self.blocks[ip] = block
+    return block
+
+
+# Block caches of each program image, by digest.
+_SHARED: Dict[str, BlockCache] = {}
+
+
+def shared_cache(image) -> BlockCache:
+  """
+  Return the block cache shared by computers running `image`.
+
+  """
+  cache = _SHARED.get(image.digest)
+  if cache is None:
+    cache = _SHARED[image.digest] = BlockCache(image)
+  return cache
+
+
+class _BlockWriter:
+  """
+  Accumulates the Python source for a single block.
+
+  """
+  def __init__(self, c, start: int, cache: BlockCache):
+    self.c = c
+    self.start = start
+    self.volatile = cache.volatile
+    # Pages which every memory the block is used with has, so which can be
+    # indexed directly.
+    memory = c.memory if cache.image is None else cache.image.memory
+    self.direct = set(memory.pages)
+    self.lines = ["def block({}):".format(ARGS), "  rb = c.rel_base"]
+    self.indent = 1
+    self.temps = 0
+    # Cells whose values are compiled into the block, and their values.
+    self.cells = {}
+    # Those of `cells` which hold operands.
+    self.operands = set()
+    # Pages indexed directly.
+    self.reads = set()
+
+  def emit(self, line: str):
+    self.lines.append("  " * self.indent + line)
+
+  def temp(self) -> str:
+    self.temps += 1
+    return "t{}".format(self.temps)
+
+  def load(self, addr: int) -> str:
+    """
+    Return an expression for the value of the cell at constant `addr`.
+
+    """
+    page = addr >> PAGE_BITS
+    if addr >= 0 and page in self.direct:
+      self.reads.add(page)
+      return "pages[{}][{}]".format(page, addr & PAGE_MASK)
+    return "_load(mem, {})".format(addr)
+
+  def operand(self, addr: int, param: int) -> Union[int, str]:
+    """
+    Return the operand held in cell `addr`.
+
+    This is `param` itself, compiled in, unless the cell has been patched
+    before, when code is emitted to read it and the name it's read into is
+    returned.
+
+    """
+    if addr in self.volatile:
+      value = self.temp()
+      self.emit("{} = {}".format(value, self.load(addr)))
+      return value
+
+    self.cells[addr] = param
+    self.operands.add(addr)
+    return param
+
+  def read(self, mode: int, param: Union[int, str]) -> str:
+    """
+    Emit any code needed to read an operand, returning an expression for it.
+
+    """
+    if mode == 1:
+      return str(param)
+
+    if mode == 0 and isinstance(param, int):
+      return self.load(param)
+
+    addr = self.temp()
+    value = self.temp()
+    if mode == 0:
+      self.emit("{} = {}".format(addr, param))
+    else:
+      self.emit("{} = rb + {}".format(addr, param))
+    self.emit("try:")
+    self.emit("  {} = pages[{} >> {}][{} & {}]".format(
+      value, addr, PAGE_BITS, addr, PAGE_MASK))
+    self.emit("except KeyError:")
+    self.emit("  {} = _load(mem, {})".format(value, addr))
+    return value
+
+  def write(self, mode: int, param: Union[int, str], value: str, next_ip: int):
+    """
+    Emit code to write `value` to an operand.
+
+    If the write lands on a code cell, the block exits so that the
+    modified code is recompiled before it runs.
+
+    """
+    if mode == 0 and isinstance(param, int):
+      addr = repr(param)
+      self.emit("if {} in owned:".format(param >> PAGE_BITS))
+      self.emit("  try:")
+      self.emit("    pages[{}][{}] = {}".format(
+        param >> PAGE_BITS, param & PAGE_MASK, value))
+    else:
+      addr = self.temp()
+      page = self.temp()
+      if mode == 0:
+        self.emit("{} = {}".format(addr, param))
+      else:
+        self.emit("{} = rb + {}".format(addr, param))
+      self.emit("{} = {} >> {}".format(page, addr, PAGE_BITS))
+      self.emit("if {} in owned:".format(page))
+      self.emit("  try:")
+      self.emit("    pages[{}][{} & {}] = {}".format(
+        page, addr, PAGE_MASK, value))
+
+    # Typed pages can't hold values over 64 bits; the memory promotes them.
+    self.emit("  except OverflowError:")
+    self.emit("    _store(mem, {}, {})".format(addr, value))
+    self.emit("else:")
+    self.emit("  _store(mem, {}, {})".format(addr, value))
+    self.emit("if {} in code:".format(addr))
+    self.emit("  c.invalidate({})".format(addr))
+    self.emit("  c.rel_base = rb")
+    self.emit("  return {}".format(next_ip))
+
+  def leave(self, ip: str):
+    self.emit("c.rel_base = rb")
+    self.emit("return {}".format(ip))
+
+  def sync(self, ip: int):
+    """
+    Store the IP and relative base before calling out of the block.
+
+    """
+    self.emit("c.ip = {}".format(ip))
+    self.emit("c.rel_base = rb")
+
+
+def _compile_instruction(
+    w: _BlockWriter, ip: int, inst: "computer.Instruction") -> bool:
+  """
+  Emit the code for a single instruction.
+
+  Returns True if the instruction ends the block.
+
+  """
+  code = inst.op.code
+  modes = inst.modes
+  params = [w.operand(ip + 1 + pos, param)
+            for pos, param in enumerate(inst.params)]
+  next_ip = inst.next_ip
+
+  if code in (1, 2, 7, 8):
+    a = w.read(modes[0], params[0])
+    b = w.read(modes[1], params[1])
+    if code == 1:
+      value = "{} + {}".format(a, b)
+    elif code == 2:
+      value = "{} * {}".format(a, b)
+    elif code == 7:
+      value = "(1 if {} < {} else 0)".format(a, b)
+    else:
+      value = "(1 if {} == {} else 0)".format(a, b)
+    result = w.temp()
+    w.emit("{} = {}".format(result, value))
+    w.write(modes[2], params[2], result, next_ip)
+
+  elif code == 3:
+    w.sync(ip)
+    value = w.temp()
+    w.emit("{} = input_fn()".format(value))
+    w.write(modes[0], params[0], value, next_ip)
+
+  elif code == 4:
+    value = w.read(modes[0], params[0])
+    w.sync(ip)
+    w.emit("output_fn({})".format(value))
+
+  elif code in (5, 6):
+    cond = w.read(modes[0], params[0])
+    w.emit("if {} {} 0:".format(cond, "!=" if code == 5 else "=="))
+    # The target is only read if the jump is taken.
+    w.indent += 1
+    target = w.read(modes[1], params[1])
+    w.emit("c.rel_base = rb")
+    w.emit("return {}".format(target))
+    w.indent -= 1
+    w.leave(repr(next_ip))
+    return True
+
+  elif code == 9:
+    w.emit("rb += {}".format(w.read(modes[0], params[0])))
+
+  elif code == 99:
+    w.sync(ip)
+    w.emit("return None")
+    return True
+
+  else:
+    raise computer.InvalidOpCode("Invalid op code: {}".format(code))
+
+  return False
+
+
+def compile_block(c, start: int, cache: BlockCache) -> Callable:
+  """
+  Compile the block starting at `start` in the memory of computer `c`.
+
+  Cells in `cache.volatile` are read when the block runs. The block is
+  compiled to be valid for any memory `cache` checks as usable for it.
+
+  The returned function has an `end` attribute giving the IP just past the
+  last instruction in the block, a `length` attribute giving the number of
+  instructions in it, and a `source` attribute with the generated Python.
+  `cells` maps each cell whose value is compiled in to that value, and
+  `operands` holds those cells which are operands.
+
+  """
+  insts = []
+  ip = start
+  for _ in range(MAX_BLOCK_LENGTH):
+    try:
+      inst = c.decode_single(ip)
+    except (computer.InvalidOpCode, computer.InvalidMemoryMode):
+      if ip == start:
+        raise
+      # Stop before the bad instruction; it raises when it is reached.
+      break
+    if inst.op.code in STARTS_BLOCK and insts:
+      break
+    insts.append((ip, inst))
+    ip = inst.next_ip
+    if inst.op.code in ENDS_BLOCK:
+      break
+  end = ip
+
+  # Operands which the block itself patches are read from memory up front,
+  # rather than each patch stopping the block to recompile it.
+  operand_cells = {addr for at, inst in insts
+                   for addr in range(at + 1, inst.next_ip)}
+  for _, inst in insts:
+    if inst.op.code in WRITERS and inst.modes[-1] == 0:
+      if inst.params[-1] in operand_cells:
+        cache.volatile.add(inst.params[-1])
+
+  w = _BlockWriter(c, start, cache)
+  ended = False
+  for ip, inst in insts:
+    w.cells[ip] = c.memory[ip]
+    ended = _compile_instruction(w, ip, inst)
+  if not ended:
+    w.leave(repr(end))
+
+  source = "\n".join(w.lines)
+  namespace = {"_load": _load, "_store": _store}
+  exec(compile(source, "<intcode block {}>".format(start), "exec"), namespace)
+
+  block = namespace["block"]
+  block.end = end
+  block.length = len(insts)
+  block.source = source
+  block.cells = w.cells
+  block.operands = frozenset(w.operands)
+  block.pages = frozenset(addr >> PAGE_BITS for addr in w.cells)
+  block.reads = frozenset(w.reads)
+  block.checks = _checks(w.cells)
+  return block
+
+
+def _checks(cells: Dict[int, int]) -> Tuple[Tuple[int, Callable, Any], ...]:
+  """
+  Group `cells` by page, as (page, getter, values) where `getter` fetches
+  from the page what should equal `values`.
+
+  """
+  by_page = {}
+  for addr, value in sorted(cells.items()):
+    by_page.setdefault(addr >> PAGE_BITS, []).append((addr & PAGE_MASK, value))
+
+  checks = []
+  for page, offsets in by_page.items():
+    # Given one index, `itemgetter` returns the item rather than a tuple.
+    get = operator.itemgetter(*(offset for offset, _ in offsets))
+    values = tuple(value for _, value in offsets)
+    checks.append((page, get, values if len(values) > 1 else values[0]))
+  return tuple(checks)
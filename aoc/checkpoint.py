@@ -0,0 +1,181 @@
+"""
+On-disk checkpoints of Intcode computer state.
+
+A checkpoint file is laid out as:
+
+  header      magic, version, ip, rel_base, sizes of the sections below
+  inputs      pending inputs, as comma-separated decimal text
+  outputs     pending outputs, as comma-separated decimal text
+  page table  (page index, kind, offset, size) for each memory page
+  pages       raw little-endian int64 pages, aligned to `ALIGNMENT`
+
+Pages holding a value too large for an int64 are stored as decimal text
+instead. Raw pages are memory-mapped when loaded and only copied into
+Python objects when written to, so loading is cheap however large the
+memory is.
+
+"""
+import array
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from typing import *
+
+from .memory import PAGE_SIZE, PagedMemory
+
+
+__all__ = (
+  "Checkpoint",
+  "CheckpointError",
+  "load_checkpoint",
+  "save_checkpoint",
+)
+
+
+MAGIC = b"ICKP"
+VERSION = 1
+HEADER = struct.Struct("<4sIqqQQQ")
+PAGE_ENTRY = struct.Struct("<qqQQ")
+PAGE_BYTES = PAGE_SIZE * 8
+# Offset alignment of raw pages; a multiple of the OS page size.
+ALIGNMENT = max(PAGE_BYTES, mmap.ALLOCATIONGRANULARITY)
+
+# Kinds of stored page.
+RAW = 0
+TEXT = 1
+
+
+class CheckpointError(Exception):
+  """
+  Exception raised when a checkpoint file can't be read.
+
+  """
+  pass
+
+
+class Checkpoint(NamedTuple):
+  ip: int
+  rel_base: int
+  memory: PagedMemory
+  inputs: Tuple[int, ...]
+  outputs: Tuple[int, ...]
+
+
+def _encode_values(values: Sequence[int]) -> bytes:
+  return ",".join(str(x) for x in values).encode("ascii")
+
+
+def _decode_values(data: bytes) -> List[int]:
+  if not data:
+    return []
+  return [int(x) for x in data.decode("ascii").split(",")]
+
+
+def _encode_page(page: Sequence[int]) -> Tuple[int, bytes]:
+  try:
+    values = array.array("q", page)
+  except OverflowError:
+    return TEXT, _encode_values(page)
+  if sys.byteorder != "little":
+    values.byteswap()
+  return RAW, values.tobytes()
+
+
+def save_checkpoint(
+    path: str,
+    ip: int,
+    rel_base: int,
+    memory: PagedMemory,
+    inputs: Sequence[int] = (),
+    outputs: Sequence[int] = ()):
+  """
+  Write a checkpoint of the given state to `path`.
+
+  Pages which have never been written to are not stored.
+
+  The checkpoint is written to a new file which then replaces `path`, so
+  memory still mapped from a checkpoint previously at `path` is unaffected.
+
+  """
+  input_data = _encode_values(inputs)
+  output_data = _encode_values(outputs)
+  pages = [(index, _encode_page(page))
+           for index, page in sorted(memory.pages.items())]
+
+  table_end = (HEADER.size + len(input_data) + len(output_data) +
+               PAGE_ENTRY.size * len(pages))
+  offset = -(-table_end // ALIGNMENT) * ALIGNMENT
+  entries = []
+  for index, (kind, data) in pages:
+    entries.append(PAGE_ENTRY.pack(index, kind, offset, len(data)))
+    offset += len(data)
+
+  fd, temp_path = tempfile.mkstemp(
+    dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+  try:
+    with os.fdopen(fd, "wb") as f:
+      f.write(HEADER.pack(
+        MAGIC, VERSION, ip, rel_base,
+        len(input_data), len(output_data), len(pages)))
+      f.write(input_data)
+      f.write(output_data)
+      f.write(b"".join(entries))
+      f.write(bytes(-(-table_end // ALIGNMENT) * ALIGNMENT - table_end))
+      for _, (_, data) in pages:
+        f.write(data)
+    os.replace(temp_path, path)
+  except BaseException:
+    os.unlink(temp_path)
+    raise
+
+
+def load_checkpoint(path: str) -> Checkpoint:
+  """
+  Read the checkpoint at `path`.
+
+  Raw pages of the returned memory are read-only views of the mapped file,
+  which `PagedMemory` copies on their first write.
+
+  """
+  with open(path, "rb") as f:
+    size = f.seek(0, 2)
+    if size < HEADER.size:
+      raise CheckpointError("Checkpoint truncated", path)
+    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+  magic, version, ip, rel_base, input_size, output_size, page_count = (
+    HEADER.unpack_from(mapped, 0))
+  if magic != MAGIC:
+    raise CheckpointError("Not a checkpoint", path)
+  if version != VERSION:
+    raise CheckpointError("Unsupported checkpoint version", path, version)
+
+  offset = HEADER.size
+  inputs = _decode_values(mapped[offset:offset + input_size])
+  offset += input_size
+  outputs = _decode_values(mapped[offset:offset + output_size])
+  offset += output_size
+
+  view = memoryview(mapped)
+  memory = PagedMemory()
+  for _ in range(page_count):
+    index, kind, start, length = PAGE_ENTRY.unpack_from(mapped, offset)
+    offset += PAGE_ENTRY.size
+    if start + length > size:
+      raise CheckpointError("Checkpoint truncated", path)
+
+    if kind == TEXT:
+      memory.pages[index] = _decode_values(mapped[start:start + length])
+    elif kind == RAW and length == PAGE_BYTES:
+      if sys.byteorder == "little":
+        memory.pages[index] = view[start:start + length].cast("q")
+      else:
+        page = array.array("q", mapped[start:start + length])
+        page.byteswap()
+        memory.pages[index] = page.tolist()
+    else:
+      raise CheckpointError("Bad page entry", path, index)
+
+  return Checkpoint(ip, rel_base, memory, tuple(inputs), tuple(outputs))
@@ -1,7 +1,20 @@
+import collections
+import concurrent.futures
+import copy
 import dataclasses
 import enum
+import itertools
+import os
+import time
 from typing import *
 
+from . import block_compiler
+from . import checkpoint
+from . import profiler
+from . import program
+from . import tracer
+from .memory import PAGE_BITS, PAGE_MASK, PagedMemory
+
 
 class ComputerError(Exception):
   """
@@ -42,6 +55,28 @@ class ProgramFinished(Exception):
   pass
 
 
+class InputRequired(Exception):
+  """
+  Exception raised by an input function when no input is available.
+
+  The input instruction is left unexecuted, so the computer can be resumed
+  once more input has been supplied.
+
+  """
+  pass
+
+
+class State(enum.Enum):
+  """
+  Reason a computer stopped running.
+
+  """
+  HALTED = "halted"
+  NEEDS_INPUT = "needs-input"
+  # Ran for the number of steps it was allowed.
+  BUDGET_EXHAUSTED = "budget-exhausted"
+
+
 @dataclasses.dataclass
 class Operation:
   code: int
@@ -63,46 +98,220 @@ OPERATIONS = {
 }
 
 
+# Superinstructions, keyed by the opcodes of the pair of instructions they
+# replace.
+FUSED_OPERATIONS = {
+  (7, 5): Operation(75, "less-than+jump-if-true", 5),
+  (7, 6): Operation(76, "less-than+jump-if-false", 5),
+  (8, 5): Operation(85, "equals+jump-if-true", 5),
+  (8, 6): Operation(86, "equals+jump-if-false", 5),
+  (9, 5): Operation(95, "adjust-rel-base+jump-if-true", 3),
+  (9, 6): Operation(96, "adjust-rel-base+jump-if-false", 3),
+  (1, 9): Operation(19, "add+adjust-rel-base", 4),
+}
+
+# Longest run of cells covered by a single decoded instruction.
+MAX_INSTRUCTION_LENGTH = 8
+
+
+@dataclasses.dataclass(frozen=True)
+class Instruction:
+  """
+  A decoded instruction.
+
+  Holds everything needed to execute the instruction at a given IP without
+  re-reading the opdata: the handler, the addressing mode for each operand
+  and the raw operand values.
+
+  A superinstruction covers two adjacent instructions, with the modes and
+  operands of both.
+
+  """
+  op: Operation
+  handler: Callable
+  modes: Tuple[int, ...]
+  params: Tuple[int, ...]
+  next_ip: int
+  # For a superinstruction, the instructions it replaces.
+  parts: Tuple["Instruction", ...] = ()
+
+
+def _print_output(value):
+  print("Output: {}".format(value))
+
+
+@dataclasses.dataclass(frozen=True)
+class Snapshot:
+  """
+  Saved state of a computer, as returned by `BaseComputer.snapshot`.
+
+  """
+  ip: int
+  rel_base: int
+  memory: PagedMemory
+  decoded: Dict[int, Instruction]
+  code_cells: FrozenSet[int]
+  inputs: Tuple[int, ...] = ()
+  outputs: Tuple[int, ...] = ()
+
+
+def _steps(max_steps: Optional[int]) -> Iterator[None]:
+  """
+  Iterate once per step allowed by `max_steps`, or forever if it is None.
+
+  """
+  if max_steps is None:
+    return itertools.repeat(None)
+  return itertools.repeat(None, max_steps)
+
+
 class BaseComputer:
   """
   Intcode computer.
 
   """
-  MEMSIZE = 2 ** 16
+  compiled = False
+  profile = None
+  trace = None
+  # Whether to fuse common pairs of instructions into superinstructions.
+  fuse = True
 
   def __init__(self):
     self.ip = 0
     self.rel_base = 0
     
-  def init_memory(self, memory: Optional[List[int]] = None):
-    self.memory = [0] * self.MEMSIZE
-    if memory is not None:
-      assert len(memory) < self.MEMSIZE
-      self.memory[:len(memory)] = memory[:]
+  def init_memory(
+      self, memory: Union[List[int], program.ProgramImage, None] = None):
+    if isinstance(memory, program.ProgramImage):
+      # Share the image's pages rather than copying them.
+      self.memory = memory.memory.copy()
+      self.memory.image = memory
+    else:
+      self.memory = PagedMemory(memory)
+    self.clear_decoded()
 
   def init_memory_from_string(self, memory: str):
-    int_mem = [int(x) for x in memory.split(",")]
-    self.init_memory(int_mem)
-    
-  
+    self.init_memory(program.load_program(memory))
 
+  def clear_decoded(self):
+    """
+    Drop all cached decoded instructions and compiled blocks.
 
-class Computer(BaseComputer):
-  """
-  Intcode computer.
+    Must be called after writing to `self.memory` directly rather than
+    through `write`.
 
-  """
-  MEMSIZE = 2 ** 16
+    """
+    self.decoded = {}
+    self.code_cells = set()
+    self.fusion_counts = collections.Counter()
+    self.blocks = {}
+    # Blocks for a memory not copied from a program image.
+    self.local_blocks = block_compiler.BlockCache()
+    self.compile_counts = collections.Counter()
 
-  def __init__(self, memory: Optional[List[int]] = None):
-    self.reset()
-    self.init_memory(memory)
+  def pending_io(self) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    """
+    Return the queued (inputs, outputs) which have not yet been consumed.
 
-  def reset(self):
-    self.ip = 0
-    self.rel_base = 0
+    """
+    return (), ()
+
+  def set_pending_io(self, inputs: Sequence[int], outputs: Sequence[int]):
+    """
+    Replace the queued inputs and outputs.
+
+    """
+
+  def snapshot(self) -> Snapshot:
+    """
+    Capture the current state of the computer.
+
+    Memory pages are shared copy-on-write with the snapshot, so this is
+    cheap regardless of the memory size.
+
+    """
+    inputs, outputs = self.pending_io()
+    return Snapshot(
+      self.ip,
+      self.rel_base,
+      self.memory.copy(),
+      dict(self.decoded),
+      frozenset(self.code_cells),
+      inputs,
+      outputs)
+
+  def restore(self, snapshot: Snapshot):
+    """
+    Return the computer to the state captured in `snapshot`.
+
+    The same snapshot can be restored any number of times.
+
+    """
+    self.ip = snapshot.ip
+    self.rel_base = snapshot.rel_base
+    self.memory = snapshot.memory.copy()
+    self.decoded = dict(snapshot.decoded)
+    self.code_cells = set(snapshot.code_cells)
+    # Blocks were only checked to be valid for the old memory.
+    self.blocks = {}
+    self.set_pending_io(snapshot.inputs, snapshot.outputs)
+
+  def fork(self, share_profile: bool = False) -> "BaseComputer":
+    """
+    Return an independent copy of the computer.
+
+    The copy has its own counters and is never traced. It only adds to this
+    computer's profile if `share_profile` is set.
+
+    """
+    snapshot = self.snapshot()
+    clone = copy.copy(self)
+    clone.detach(share_profile)
+    clone.restore(snapshot)
+    return clone
+
+  def detach(self, share_profile: bool = False):
+    """
+    Give a shallow copy of a computer its own counters and instrumentation.
+
+    """
+    self.fusion_counts = collections.Counter()
+    self.compile_counts = collections.Counter()
+    if not share_profile:
+      self.profile = None
+    if self.trace is not None:
+      self.trace = None
+      vars(self).pop("fuse", None)
 
-  
+  def save(self, path: str):
+    """
+    Save the state of the computer to a checkpoint file at `path`.
+
+    """
+    inputs, outputs = self.pending_io()
+    checkpoint.save_checkpoint(
+      path, self.ip, self.rel_base, self.memory, inputs, outputs)
+
+  @classmethod
+  def load(cls, path: str) -> "BaseComputer":
+    """
+    Create a computer from a checkpoint file written by `save`.
+
+    Memory is mapped from the file, so only the pages the program touches
+    are read.
+
+    """
+    state = checkpoint.load_checkpoint(path)
+    c = cls()
+    c.restore(Snapshot(
+      state.ip,
+      state.rel_base,
+      state.memory,
+      {},
+      frozenset(),
+      state.inputs,
+      state.outputs))
+    return c
 
   @staticmethod
   def opdata_to_opcode(opdata):
@@ -112,121 +321,800 @@ class Computer(BaseComputer):
   def get_memory_mode(opdata, position):
     return (opdata // 10 ** (position + 1)) % 10
 
-  def get_param_val(self, opdata, param_pos, param, input_param=True):
-    memory_mode = self.get_memory_mode(opdata, param_pos)
+  def decode(self, ip: int) -> Instruction:
+    """
+    Decode the instruction at `ip` and add it to the cache.
+
+    If fusion is enabled and the instruction and the one after it form a
+    known idiom, a superinstruction covering both is cached instead.
+
+    """
+    inst = self.decode_single(ip)
+    if self.fuse and inst.op.code in FUSIBLE:
+      inst = self.fuse_next(ip, inst)
+
+    self.decoded[ip] = inst
+    self.code_cells.update(range(ip, inst.next_ip))
+    return inst
+
+  def fuse_next(self, ip: int, first: Instruction) -> Instruction:
+    """
+    Try to fuse `first`, at `ip`, with the instruction following it.
+
+    """
+    try:
+      second = self.decode_single(first.next_ip)
+    except ComputerError:
+      return first
+
+    op = FUSED_OPERATIONS.get((first.op.code, second.op.code))
+    if op is None:
+      return first
+
+    if first.op.code in (7, 8):
+      # Only fuse if the jump tests the result of the comparison.
+      if (second.modes[0] != first.modes[2] or
+            second.params[0] != first.params[2]):
+        return first
+
+    if first.op.code in (1, 7, 8):
+      # Don't fuse if the first instruction rewrites the second.
+      if (first.modes[2] == 0 and
+            first.next_ip <= first.params[2] < second.next_ip):
+        return first
+
+    self.fusion_counts[op.name] += 1
+    return Instruction(
+      op,
+      FUSED_HANDLERS[op.code],
+      first.modes + second.modes,
+      first.params + second.params,
+      second.next_ip,
+      (first, second))
+
+  def decode_single(self, ip: int) -> Instruction:
+    """
+    Decode the instruction at `ip`, without caching or fusing it.
 
-    if memory_mode == 0:
-      # Position mode.
-      addr = param
+    """
+    opdata = self.memory[ip]
+    try:
+      op = OPERATIONS[self.opdata_to_opcode(opdata)]
+    except KeyError:
+      raise InvalidOpCode("Invalid op code: {}".format(opdata))
+
+    modes = tuple(
+      self.get_memory_mode(opdata, pos) for pos in range(1, op.params + 1))
+    params = tuple(self.memory[ip + 1:ip + 1 + op.params])
+
+    # Negative addresses are only an error if they're used, so are checked
+    # by `read` and `write` instead.
+    for mode, param in zip(modes, params):
+      if mode not in (0, 1, 2):
+        raise InvalidMemoryMode(mode, opdata, param)
 
-    elif memory_mode == 1:
-      # Immediate mode.
+    return Instruction(op, HANDLERS[op.code], modes, params, ip + 1 + op.params)
+
+  def invalidate(self, addr: int):
+    """
+    Drop any cached instruction or compiled block which depends on `addr`.
+
+    """
+    for ip in range(addr - MAX_INSTRUCTION_LENGTH + 1, addr + 1):
+      inst = self.decoded.get(ip)
+      if inst is not None and inst.next_ip > addr:
+        del self.decoded[ip]
+
+    cache = self.block_cache()
+    for start in cache.covering.get(addr, ()):
+      block = self.blocks.get(start)
+      if block is None or addr not in block.cells:
+        # Not in use here.
+        continue
+      del self.blocks[start]
+      if addr in block.operands:
+        # A patched operand; from now on, blocks read it from memory.
+        cache.volatile.add(addr)
+      else:
+        self.compile_counts[start] += 1
+
+    # Nothing cached depends on the cell any more.
+    self.code_cells.discard(addr)
+
+  def read(self, mode: int, param: int) -> int:
+    if mode == 1:
       return param
 
-    elif memory_mode == 2:
-      # Relative mode.
-      addr = param + self.rel_base
+    addr = param if mode == 0 else param + self.rel_base
+    if addr < 0:
+      raise InvalidAddress("Address negative", addr)
+    return self.memory[addr]
 
-    else:
-      # Invalid mode.
-      raise InvalidMemoryMode(memory_mode, opdata, param)
-    
+  def address(self, mode: int, param: int) -> int:
+    addr = param if mode == 0 else param + self.rel_base
     if addr < 0:
       raise InvalidAddress("Address negative", addr)
+    return addr
+
+  def write(self, mode: int, param: int, value: int):
+    addr = self.address(mode, param)
+    self.memory[addr] = value
+    if addr in self.code_cells:
+      # Self-modifying code.
+      self.invalidate(addr)
 
+  def _add(self, inst, input_fn, output_fn):
+    modes = inst.modes
+    params = inst.params
+    self.write(
+      modes[2], params[2],
+      self.read(modes[0], params[0]) + self.read(modes[1], params[1]))
+    return inst.next_ip
+
+  def _multiply(self, inst, input_fn, output_fn):
+    modes = inst.modes
+    params = inst.params
+    self.write(
+      modes[2], params[2],
+      self.read(modes[0], params[0]) * self.read(modes[1], params[1]))
+    return inst.next_ip
+
+  def _input(self, inst, input_fn, output_fn):
+    self.write(inst.modes[0], inst.params[0], input_fn())
+    return inst.next_ip
+
+  def _output(self, inst, input_fn, output_fn):
+    output_val = self.read(inst.modes[0], inst.params[0])
+    if output_fn:
+      output_fn(output_val)
+    else:
+      print("Output: {}".format(output_val))
+    return inst.next_ip
+
+  def _jump_if_true(self, inst, input_fn, output_fn):
+    modes = inst.modes
+    params = inst.params
+    if self.read(modes[0], params[0]) != 0:
+      return self.read(modes[1], params[1])
+    return inst.next_ip
+
+  def _jump_if_false(self, inst, input_fn, output_fn):
+    modes = inst.modes
+    params = inst.params
+    if self.read(modes[0], params[0]) == 0:
+      return self.read(modes[1], params[1])
+    return inst.next_ip
+
+  def _less_than(self, inst, input_fn, output_fn):
+    modes = inst.modes
+    params = inst.params
+    self.write(
+      modes[2], params[2],
+      1 if self.read(modes[0], params[0]) < self.read(modes[1], params[1]) else 0)
+    return inst.next_ip
+
+  def _equals(self, inst, input_fn, output_fn):
+    modes = inst.modes
+    params = inst.params
+    self.write(
+      modes[2], params[2],
+      1 if self.read(modes[0], params[0]) == self.read(modes[1], params[1]) else 0)
+    return inst.next_ip
+
+  def _adjust_rel_base(self, inst, input_fn, output_fn):
+    self.rel_base += self.read(inst.modes[0], inst.params[0])
+    assert self.rel_base >= 0
+    return inst.next_ip
+
+  def _exit(self, inst, input_fn, output_fn):
+    raise ProgramFinished()
+
+  def _compare_jump(self, inst, input_fn, output_fn):
+    compare, jump = inst.parts
+    modes = compare.modes
+    params = compare.params
+    a = self.read(modes[0], params[0])
+    b = self.read(modes[1], params[1])
+    if compare.op.code == 7:
+      value = 1 if a < b else 0
+    else:
+      value = 1 if a == b else 0
+
+    # The result is still stored, in case anything else reads it.
+    addr = self.address(modes[2], params[2])
+    self.memory[addr] = value
+    if addr in self.code_cells:
+      # Self-modifying code; the jump may have changed.
+      self.invalidate(addr)
+      return compare.next_ip
+
+    if (value != 0) == (jump.op.code == 5):
+      return self.read(jump.modes[1], jump.params[1])
+    return inst.next_ip
+
+  def _adjust_rel_base_jump(self, inst, input_fn, output_fn):
+    adjust, jump = inst.parts
+    self.rel_base += self.read(adjust.modes[0], adjust.params[0])
+    assert self.rel_base >= 0
+
+    modes = jump.modes
+    params = jump.params
+    if (self.read(modes[0], params[0]) != 0) == (jump.op.code == 5):
+      return self.read(modes[1], params[1])
+    return inst.next_ip
+
+  def _add_adjust_rel_base(self, inst, input_fn, output_fn):
+    add, adjust = inst.parts
+    modes = add.modes
+    params = add.params
+    addr = self.address(modes[2], params[2])
+    self.memory[addr] = (
+      self.read(modes[0], params[0]) + self.read(modes[1], params[1]))
+    if addr in self.code_cells:
+      # Self-modifying code; the adjustment may have changed.
+      self.invalidate(addr)
+      return add.next_ip
+
+    self.rel_base += self.read(adjust.modes[0], adjust.params[0])
+    assert self.rel_base >= 0
+    return inst.next_ip
+
+  def block_cache(self) -> "block_compiler.BlockCache":
+    """
+    Return the cache of compiled blocks for the program being run.
+
+    """
+    if self.memory.image is not None:
+      return block_compiler.shared_cache(self.memory.image)
+    return self.local_blocks
+
+  def compile_block(self, ip: int) -> Callable:
+    """
+    Find or compile the block starting at `ip` and add it to the cache.
+
+    """
+    if self.compile_counts[ip] > block_compiler.MAX_RECOMPILES:
+      # Its code keeps being modified; just interpret it.
+      block = block_compiler._interpret
+    else:
+      block = self.block_cache().get(self, ip)
+
+    self.blocks[ip] = block
+    self.code_cells.update(block.cells)
+    return block
+
+  def interpret_block(
+      self, input_fn, output_fn,
+      counts: Dict[int, int]) -> Tuple[Optional[int], int]:
+    """
+    Interpret the block starting at the IP, as `run_compiled` would run it
+    compiled, adding the number of instructions run to `counts` for its
+    start.
+
+    Returns the IP to continue from, or None if the program exited, and the
+    number of instructions run.
+
+    """
+    start = self.ip
+    decoded = self.decoded
+    steps = 0
     try:
-      if input_param:
-        return self.memory[addr]
-      else:
-        return addr
-    except KeyError:
-      raise InvalidAddress("Address out of range", addr)
+      while steps < block_compiler.MAX_BLOCK_LENGTH:
+        inst = decoded.get(self.ip)
+        if inst is None:
+          inst = self.decode(self.ip)
+        if inst.op.code in block_compiler.STARTS_BLOCK and steps:
+          break
+        # Counted before it runs, as it may stop for input.
+        steps += len(inst.parts) or 1
+        try:
+          self.ip = inst.handler(self, inst, input_fn, output_fn)
+        except ProgramFinished:
+          return None, steps
 
-  def step(self, input_fn, output_fn):
-    opdata = self.memory[self.ip]
-    op = OPERATIONS[self.opdata_to_opcode(opdata)]
-    params = [self.memory[self.ip + i + 1] for i in range(op.params)]
-
-    #print(opdata, params)
-
-    if op.code == 1:
-      # Add
-      output_addr = self.get_param_val(opdata, 3, params[2], input_param=False)
-      self.memory[output_addr] = (
-        self.get_param_val(opdata, 1, params[0]) +
-        self.get_param_val(opdata, 2, params[1]))
-
-    elif op.code == 2:
-      # Multiply
-      output_addr = self.get_param_val(opdata, 3, params[2], input_param=False)
-      self.memory[output_addr] = (
-        self.get_param_val(opdata, 1, params[0]) *
-        self.get_param_val(opdata, 2, params[1]))
-
-    elif op.code == 3:
-      # Input
-      output_addr = self.get_param_val(opdata, 1, params[0], input_param=False)
-      self.memory[output_addr] = input_fn()
-
-    elif op.code == 4:
-      # Output
-      output_val = self.get_param_val(opdata, 1, params[0])
+        last = inst.parts[-1] if inst.parts else inst
+        if last.op.code in block_compiler.ENDS_BLOCK:
+          break
+      return self.ip, steps
+
+    finally:
+      counts[start] += steps
+
+  def run_interpreted(
+      self, input_fn=None, output_fn=None,
+      max_steps: Optional[int] = None) -> State:
+    decoded = self.decoded
+    try:
+      for _ in _steps(max_steps):
+        inst = decoded.get(self.ip)
+        if inst is None:
+          inst = self.decode(self.ip)
+        self.ip = inst.handler(self, inst, input_fn, output_fn)
+
+    except ProgramFinished:
+      return State.HALTED
+
+    return State.BUDGET_EXHAUSTED
+
+  def run_compiled(
+      self, input_fn=None, output_fn=None,
+      max_steps: Optional[int] = None) -> State:
+    """
+    Run the program as compiled blocks.
+
+    The budget is only checked between blocks, and each block is charged
+    for all of its instructions, so up to a block's worth of instructions
+    past `max_steps` may run.
+
+    """
+    if output_fn is None:
+      output_fn = _print_output
+
+    memory = self.memory
+    pages = memory.pages
+    owned = memory.owned
+    code = self.code_cells
+    blocks = self.blocks
+    budget = float("inf") if max_steps is None else max_steps
+    interpreted = self.block_cache().interpreted
+
+    ip = self.ip
+    while ip is not None:
+      self.ip = ip
+      if budget <= 0:
+        return State.BUDGET_EXHAUSTED
+      block = blocks.get(ip)
+      if block is None:
+        if interpreted[ip] < block_compiler.COMPILE_AFTER:
+          ip, steps = self.interpret_block(input_fn, output_fn, interpreted)
+          budget -= steps
+          continue
+        block = self.compile_block(ip)
+      ip = block(self, pages, owned, memory, code, input_fn, output_fn)
+      budget -= block.length
+
+    return State.HALTED
+
+  def run_profiled(
+      self, input_fn=None, output_fn=None,
+      max_steps: Optional[int] = None) -> State:
+    """
+    Interpret the program, recording what runs in `self.profile`.
+
+    Superinstructions are recorded as the instructions they replace.
+
+    """
+    profile = self.profile
+    ip_counts = profile.ip_counts
+    op_mode_counts = profile.op_mode_counts
+
+    def counted_input():
+      start = time.perf_counter()
+      try:
+        value = input_fn()
+      except InputRequired:
+        profile.input_waits += 1
+        raise
+      finally:
+        profile.input_time += time.perf_counter() - start
+      profile.inputs += 1
+      return value
+
+    def counted_output(value):
+      profile.outputs += 1
       if output_fn:
-        output_fn(output_val)
+        output_fn(value)
       else:
-        print("Output: {}".format(output_val))
-  
-    elif op.code == 5:
-      # Jump if true
-      if self.get_param_val(opdata, 1, params[0]) != 0:
-        self.ip = self.get_param_val(opdata, 2, params[1])
-        # Don't increment IP
-        return
-
-    elif op.code == 6:
-      # Jump if false
-      if self.get_param_val(opdata, 1, params[0]) == 0:
-        self.ip = self.get_param_val(opdata, 2, params[1])
-        # Don't increment IP
-        return
-
-    elif op.code == 7:
-      # Less than
-      output_addr = self.get_param_val(opdata, 3, params[2], input_param=False)
-      if self.get_param_val(opdata, 1, params[0]) < self.get_param_val(opdata, 2, params[1]):
-        self.memory[output_addr] = 1
-      else:
-        self.memory[output_addr] = 0
+        _print_output(value)
 
-    elif op.code == 8:
-      # Equals
-      output_addr = self.get_param_val(opdata, 3, params[2], input_param=False)
-      if self.get_param_val(opdata, 1, params[0]) == self.get_param_val(opdata, 2, params[1]):
-        self.memory[output_addr] = 1
-      else:
-        self.memory[output_addr] = 0
+    decoded = self.decoded
+    start = time.perf_counter()
+    try:
+      for _ in _steps(max_steps):
+        inst = decoded.get(self.ip)
+        if inst is None:
+          inst = self.decode(self.ip)
+        # Count each instruction a superinstruction covers separately.
+        ip = self.ip
+        for part in inst.parts or (inst,):
+          ip_counts[ip] += 1
+          op_mode_counts[(part.op.name, part.modes)] += 1
+          ip = part.next_ip
+        self.ip = inst.handler(self, inst, counted_input, counted_output)
+
+    except ProgramFinished:
+      return State.HALTED
 
-    elif op.code == 9:
-      # Change relative base.
-      self.rel_base += self.get_param_val(opdata, 1, params[0])
-      assert self.rel_base >= 0
+    finally:
+      profile.elapsed += time.perf_counter() - start
 
-    elif op.code == 99:
-      # Abort
-      raise ProgramFinished()
+    return State.BUDGET_EXHAUSTED
 
-    else:
-      raise InvalidOpCode("Invalid op code: {}".format(op.code))
+  def enable_profiling(
+      self, profile: Optional[profiler.Profile] = None) -> profiler.Profile:
+    """
+    Record a profile of everything the computer runs from now on.
 
-    self.ip += 1 + op.params
+    Pass in an existing profile to add to its counts.
 
-  def run(self, input_fn=None, output_fn=None):
+    """
+    if profile is None:
+      profile = profiler.Profile()
+    self.profile = profile
+    return profile
+
+  def disable_profiling(self):
+    self.profile = None
+
+  def run_traced(
+      self, input_fn=None, output_fn=None,
+      max_steps: Optional[int] = None) -> State:
+    """
+    Interpret the program, recording what runs in `self.trace`.
+
+    """
+    trace = self.trace
+    inputs = trace.inputs
+
+    def logged_input():
+      value = input_fn()
+      inputs.append(value)
+      return value
+
+    ips = trace.ips
+    instructions = trace.instructions
+    values = trace.values
+    size = trace.size
+    writers = tracer.WRITERS
+    pages = self.memory.pages
+    decoded = self.decoded
+    step = trace.steps
     try:
-      while True:
-        self.step(input_fn, output_fn)
+      for _ in _steps(max_steps):
+        ip = self.ip
+        inst = decoded.get(ip)
+        if inst is None:
+          inst = self.decode(ip)
+        self.ip = inst.handler(self, inst, logged_input, output_fn)
+
+        index = step % size
+        ips[index] = ip
+        instructions[index] = inst
+        if inst.op.code in writers:
+          addr = inst.params[-1]
+          if inst.modes[-1] == 2:
+            addr += self.rel_base
+          try:
+            value = pages[addr >> PAGE_BITS][addr & PAGE_MASK]
+          except KeyError:
+            value = 0
+          try:
+            values[index] = value
+          except OverflowError:
+            trace.overflow[step] = value
+        step += 1
 
     except ProgramFinished:
-      pass
+      index = step % size
+      ips[index] = ip
+      instructions[index] = inst
+      step += 1
+      return State.HALTED
+
+    finally:
+      trace.steps = step
+
+    return State.BUDGET_EXHAUSTED
+
+  def enable_tracing(
+      self, trace: Optional[tracer.Trace] = None) -> tracer.Trace:
+    """
+    Record a trace of everything the computer runs from now on.
+
+    Fusion is turned off while tracing, so that every instruction is
+    recorded as it appears in memory.
+
+    """
+    if trace is None:
+      trace = tracer.Trace()
+    trace.start = self.snapshot()
+    self.trace = trace
+    self.fuse = False
+    self.clear_decoded()
+    return trace
+
+  def disable_tracing(self):
+    self.trace = None
+    vars(self).pop("fuse", None)
+    self.clear_decoded()
+
+  def run_loop(self) -> Callable:
+    """
+    Return the loop to run the program with.
+
+    """
+    if self.trace is not None:
+      return self.run_traced
+    elif self.profile is not None:
+      return self.run_profiled
+    elif self.compiled:
+      return self.run_compiled
+    else:
+      return self.run_interpreted
+
+  def execute(
+      self, input_fn=None, output_fn=None,
+      max_steps: Optional[int] = None) -> State:
+    """
+    Run until the program exits or `input_fn` raises `InputRequired`.
+
+    If `max_steps` is given, also stop once about that many instructions
+    have run, so that one thread can take turns running many computers.
+    The interpreter stops after exactly `max_steps` steps, counting a
+    superinstruction as one; compiled code may overrun by part of a block.
+
+    """
+    try:
+      return self.run_loop()(input_fn, output_fn, max_steps)
+
+    except InputRequired:
+      return State.NEEDS_INPUT
+
+  def run_until_blocked(
+      self, inputs: Iterable[int] = ()) -> Tuple[List[int], State]:
+    """
+    Run until the program exits or needs more input than `inputs` supplies.
+
+    Returns the outputs produced and the reason the computer stopped. Any
+    inputs left unconsumed when the program exits are discarded.
+
+    """
+    pending = collections.deque(inputs)
+    outputs = []
+
+    def input_fn():
+      if pending:
+        return pending.popleft()
+      raise InputRequired()
+
+    state = self.execute(input_fn, outputs.append)
+    return outputs, state
+
+  def step(self, input_fn, output_fn):
+    inst = self.decoded.get(self.ip)
+    if inst is None:
+      inst = self.decode(self.ip)
+
+    self.ip = inst.handler(self, inst, input_fn, output_fn)
+
+
+HANDLERS = {
+  1: BaseComputer._add,
+  2: BaseComputer._multiply,
+  3: BaseComputer._input,
+  4: BaseComputer._output,
+  5: BaseComputer._jump_if_true,
+  6: BaseComputer._jump_if_false,
+  7: BaseComputer._less_than,
+  8: BaseComputer._equals,
+  9: BaseComputer._adjust_rel_base,
+  99: BaseComputer._exit,
+}
+
+FUSED_HANDLERS = {
+  75: BaseComputer._compare_jump,
+  76: BaseComputer._compare_jump,
+  85: BaseComputer._compare_jump,
+  86: BaseComputer._compare_jump,
+  95: BaseComputer._adjust_rel_base_jump,
+  96: BaseComputer._adjust_rel_base_jump,
+  19: BaseComputer._add_adjust_rel_base,
+}
+
+# Opcodes which can start a superinstruction.
+FUSIBLE = frozenset(first for first, _ in FUSED_OPERATIONS)
+
+
+class Computer(BaseComputer):
+  """
+  Intcode computer.
+
+  If `compiled` is set, `run` compiles the program into Python functions
+  one basic block at a time instead of interpreting each instruction.
+
+  """
+  def __init__(self, memory: Optional[List[int]] = None, compiled: bool = False):
+    self.compiled = compiled
+    self.reset()
+    self.init_memory(memory)
+
+  def reset(self):
+    self.ip = 0
+    self.rel_base = 0
+
+  def run(
+      self, input_fn=None, output_fn=None,
+      max_steps: Optional[int] = None) -> Optional[State]:
+    """
+    Run the program, returning why it stopped.
+
+    See `execute` for `max_steps`.
+
+    """
+    try:
+      return self.execute(input_fn, output_fn, max_steps)
 
     except InvalidOpCode as e:
-      print(str(e))
\ No newline at end of file
+      print(str(e))
+
+
+class PureQuery:
+  """
+  Answers queries to a program which maps a fixed set of inputs to outputs.
+
+  The program is run once, up to the point where it first needs input,
+  and that state is snapshotted. Each query restores the snapshot, runs the
+  program with the query's inputs and returns the outputs produced from
+  then on, so setup code is only ever run once.
+
+  Answers are kept in an LRU cache of at most `cache_size` entries, keyed
+  by the inputs. The program must not depend on anything but its inputs.
+
+  """
+  def __init__(
+      self,
+      program_text: Union[str, Sequence[int], program.ProgramImage],
+      cache_size: int = 4096):
+    if isinstance(program_text, str):
+      program_text = program.load_program(program_text)
+    self.computer = Computer(program_text)
+    # Outputs of the setup code, which are not part of any answer.
+    self.setup_outputs, self.setup_state = self.computer.run_until_blocked()
+    self.initial = self.computer.snapshot()
+
+    self.cache_size = cache_size
+    self.cache = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def __call__(self, *inputs: int) -> Tuple[int, ...]:
+    try:
+      outputs = self.cache[inputs]
+    except KeyError:
+      pass
+    else:
+      self.cache.move_to_end(inputs)
+      self.hits += 1
+      return outputs
+
+    self.misses += 1
+    self.computer.restore(self.initial)
+    outputs, _ = self.computer.run_until_blocked(inputs)
+    outputs = tuple(outputs)
+    self.learn_decoded()
+
+    self.cache[inputs] = outputs
+    if len(self.cache) > self.cache_size:
+      self.cache.popitem(last=False)
+    return outputs
+
+  def learn_decoded(self):
+    """
+    Add instructions decoded by the last query to the snapshot.
+
+    Only instructions whose cells are unchanged from the snapshot are
+    kept, so later queries don't decode them again.
+
+    """
+    initial = self.initial
+    learned = {}
+    for ip, inst in self.computer.decoded.items():
+      if ip in initial.decoded:
+        continue
+      cells = range(ip, inst.next_ip)
+      if all(self.computer.memory[addr] == initial.memory[addr]
+             for addr in cells):
+        learned[ip] = inst
+
+    if learned:
+      decoded = dict(initial.decoded)
+      decoded.update(learned)
+      code_cells = set(initial.code_cells)
+      for ip, inst in learned.items():
+        code_cells.update(range(ip, inst.next_ip))
+      self.initial = dataclasses.replace(
+        initial, decoded=decoded, code_cells=frozenset(code_cells))
+
+  def clear_cache(self):
+    self.cache.clear()
+
+
+def replay(
+    path: str,
+    trace: Optional[tracer.Trace] = None) -> Tuple[List[int], State]:
+  """
+  Replay a run saved with `Trace.save_replay`.
+
+  The computer is started from the saved state and given the logged
+  inputs, and runs until it exits or needs more input. Pass a `trace` to
+  record the replayed run.
+
+  """
+  state = checkpoint.load_checkpoint(path)
+  c = Computer()
+  c.restore(Snapshot(
+    state.ip, state.rel_base, state.memory, {}, frozenset()))
+  if trace is not None:
+    c.enable_tracing(trace)
+  return c.run_until_blocked(state.inputs)
+
+
+# State each run starts from in the current batch worker process.
+_batch_start = None
+
+
+def _init_batch_worker(
+    program_text: Optional[str], checkpoint_path: Optional[str] = None):
+  global _batch_start
+  if checkpoint_path is not None:
+    c = Computer.load(checkpoint_path)
+  else:
+    c = Computer(program.load_program(program_text))
+  _batch_start = c.snapshot()
+
+
+def _run_batch_chunk(chunk: List[Sequence[int]]) -> List[List[int]]:
+  results = []
+  c = Computer()
+  for inputs in chunk:
+    c.restore(_batch_start)
+    outputs, _ = c.run_until_blocked(inputs)
+    results.append(outputs)
+  return results
+
+
+def run_batch(
+    program_text: Union[str, Sequence[int], program.ProgramImage, None],
+    input_sequences: Sequence[Sequence[int]],
+    workers: Optional[int] = None,
+    chunksize: Optional[int] = None,
+    checkpoint_path: Optional[str] = None) -> List[List[int]]:
+  """
+  Run a program once for each sequence of inputs, across a process pool.
+
+  Each run stops when the program exits or runs out of input, and the
+  outputs from each run are returned in order. The program is sent to each
+  worker once, when the worker starts, and jobs are sent in chunks.
+
+  If `checkpoint_path` is given, each run instead starts from the state
+  saved there by `BaseComputer.save`, and `program_text` is ignored.
+
+  With `workers=1` the runs happen in this process.
+
+  """
+  if isinstance(program_text, program.ProgramImage):
+    program_text = program_text.values
+  if program_text is not None and not isinstance(program_text, str):
+    program_text = ",".join(str(x) for x in program_text)
+  input_sequences = [tuple(inputs) for inputs in input_sequences]
+
+  if workers is None:
+    workers = os.cpu_count() or 1
+
+  if workers == 1:
+    _init_batch_worker(program_text, checkpoint_path)
+    return _run_batch_chunk(input_sequences)
+
+  if chunksize is None:
+    # Aim for a few chunks per worker to balance the load.
+    chunksize = max(1, -(-len(input_sequences) // (workers * 4)))
+  chunks = [input_sequences[i:i + chunksize]
+            for i in range(0, len(input_sequences), chunksize)]
+
+  with concurrent.futures.ProcessPoolExecutor(
+      max_workers=workers,
+      initializer=_init_batch_worker,
+      initargs=(program_text, checkpoint_path)) as executor:
+    return [outputs
+            for results in executor.map(_run_batch_chunk, chunks)
+            for outputs in results]
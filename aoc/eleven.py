@@ -1,5 +1,3 @@
-import queue
-
 from . import async_computer
 from . import utils
 
@@ -19,33 +17,42 @@ class Printer:
     self.c.init_memory_from_string(program)
 
   def run(self):
-    self.c.run_async()
-
-    while not self.c.finished_event.isSet():
-      if self.pos in self.white_panels:
-        self.c.send(1)
-      else:
-        self.c.send(0)
-
-      # Retreive the colour.
-      # 0 - black, 1 - white
-      colour = self.c.get()
-      if colour == 0:
-        self.white_panels.discard(self.pos)
-      else:
-        self.white_panels.add(self.pos)
-      self.painted_panels.add(self.pos)
-      
-      # Get the turn direction.
-      # 0 - left, 1 - right
-      turn = self.c.get()
-      if turn == 0:
-        self.direction *= 1j
-      else:
-        self.direction *= -1j
-
-      # Move forward one square.
-      self.pos += self.direction
+    outputs = self.c.run_generator()
+
+    try:
+      # Wait for the first request for input.
+      next(outputs)
+
+      while True:
+        # Retreive the colour.
+        # 0 - black, 1 - white
+        if self.pos in self.white_panels:
+          colour = outputs.send(1)
+        else:
+          colour = outputs.send(0)
+
+        if colour == 0:
+          self.white_panels.discard(self.pos)
+        else:
+          self.white_panels.add(self.pos)
+        self.painted_panels.add(self.pos)
+        
+        # Get the turn direction.
+        # 0 - left, 1 - right
+        turn = next(outputs)
+        if turn == 0:
+          self.direction *= 1j
+        else:
+          self.direction *= -1j
+
+        # Move forward one square.
+        self.pos += self.direction
+
+        # Wait for the request for the next input.
+        next(outputs)
+
+    except StopIteration:
+      pass
 
 
 def solve_a(inp):
@@ -0,0 +1,447 @@
+"""
+Static analysis of Intcode programs.
+
+Disassembles a program by following its control flow from address 0,
+separates code from data, splits the code into basic blocks and builds a
+control-flow graph between them. Writes into code and jumps to computed
+targets are flagged, as are loops.
+
+Usable as a library via `analyze`, or from the command line:
+
+  python -m aoc.intcode_analysis 9
+  python -m aoc.intcode_analysis path/to/program.txt --blocks
+  python -m aoc.intcode_analysis 13 --dot > cfg.dot
+
+"""
+import argparse
+import collections
+import dataclasses
+import json
+import os
+import sys
+from typing import *
+
+from . import computer
+from . import program
+from . import utils
+
+
+__all__ = (
+  "Analysis",
+  "BasicBlock",
+  "analyze",
+  "format_blocks",
+  "format_dot",
+  "format_instruction",
+  "format_listing",
+)
+
+
+JUMPS = (5, 6)
+# Operations which always end a basic block.
+TERMINATORS = (5, 6, 99)
+# Operations which write to their last operand.
+WRITERS = (1, 2, 3, 7, 8)
+
+
+@dataclasses.dataclass
+class BasicBlock:
+  start: int
+  # Address just past the last instruction.
+  end: int
+  # Addresses of the instructions in the block.
+  instructions: List[int]
+  # Start addresses of the blocks control can pass to.
+  successors: List[int] = dataclasses.field(default_factory=list)
+  # Whether the block ends in a jump to a computed target.
+  indirect: bool = False
+
+
+@dataclasses.dataclass
+class Analysis:
+  length: int
+  # Decoded instructions, by address.
+  instructions: Dict[int, computer.Instruction]
+  blocks: Dict[int, BasicBlock]
+  # Addresses of instructions which jump to a computed target.
+  indirect_jumps: List[int]
+  # (instruction address, address written) for writes into code.
+  self_modifying: List[Tuple[int, int]]
+  # Addresses of writes whose target can't be known statically.
+  dynamic_writes: List[int]
+  # (block, loop header) for each edge which jumps backwards.
+  back_edges: List[Tuple[int, int]]
+
+  @property
+  def code_cells(self) -> Set[int]:
+    return {
+      addr
+      for ip, inst in self.instructions.items()
+      for addr in range(ip, inst.next_ip)}
+
+  @property
+  def data_ranges(self) -> List[Tuple[int, int]]:
+    """
+    Ranges [start, end) of the program which are never run as code.
+
+    """
+    code = self.code_cells
+    ranges = []
+    start = None
+    for addr in range(self.length + 1):
+      if addr < self.length and addr not in code:
+        if start is None:
+          start = addr
+      elif start is not None:
+        ranges.append((start, addr))
+        start = None
+    return ranges
+
+  @property
+  def loop_headers(self) -> List[int]:
+    return sorted({header for _, header in self.back_edges})
+
+  def to_dict(self) -> Dict[str, Any]:
+    return {
+      "length": self.length,
+      "instructions": len(self.instructions),
+      "data_ranges": self.data_ranges,
+      "blocks": [
+        {
+          "start": block.start,
+          "end": block.end,
+          "successors": block.successors,
+          "indirect": block.indirect,
+        }
+        for block in sorted(self.blocks.values(), key=lambda b: b.start)
+      ],
+      "indirect_jumps": self.indirect_jumps,
+      "self_modifying": self.self_modifying,
+      "dynamic_writes": self.dynamic_writes,
+      "loop_headers": self.loop_headers,
+    }
+
+
+def _decoder(values: Sequence[int]) -> computer.Computer:
+  c = computer.Computer(list(values))
+  c.fuse = False
+  return c
+
+
+def _try_decode(c: computer.Computer, addr: int, length: int):
+  if not 0 <= addr < length:
+    return None
+  try:
+    inst = c.decode_single(addr)
+  except computer.ComputerError:
+    return None
+  if inst.next_ip > length:
+    return None
+  return inst
+
+
+def _pointer_constant(inst: computer.Instruction) -> Optional[int]:
+  """
+  Return the constant stored by `inst`, if it stores one.
+
+  Programs push return addresses with e.g. `add 0, <addr>, [rb+0]`, so
+  these are candidate code addresses.
+
+  """
+  if inst.op.code in (1, 2) and inst.modes[:2] == (1, 1):
+    a, b = inst.params[:2]
+    return a + b if inst.op.code == 1 else a * b
+  return None
+
+
+def _patched_jumps(instructions: Dict[int, computer.Instruction]) -> Set[int]:
+  """
+  Return the addresses of jumps whose operands are written by the program.
+
+  """
+  written = {
+    inst.params[-1] for inst in instructions.values()
+    if inst.op.code in WRITERS and inst.modes[-1] == 0}
+  return {
+    addr for addr, inst in instructions.items()
+    if inst.op.code in JUMPS and
+    any(cell in written for cell in range(addr + 1, inst.next_ip))}
+
+
+def _jump_table(c: computer.Computer, start: int, length: int) -> List[int]:
+  """
+  Return the run of values from `start` which are valid code addresses.
+
+  """
+  entries = []
+  addr = start
+  while addr < length:
+    entry = c.memory[addr]
+    if _try_decode(c, entry, length) is None:
+      break
+    entries.append(entry)
+    addr += 1
+  return entries
+
+
+def analyze(
+    program_text: Union[str, Sequence[int], program.ProgramImage]) -> Analysis:
+  """
+  Disassemble and analyze a program.
+
+  """
+  if isinstance(program_text, str):
+    program_text = program.load_program(program_text)
+  if isinstance(program_text, program.ProgramImage):
+    program_text = program_text.values
+  values = list(program_text)
+  length = len(values)
+  c = _decoder(values)
+
+  # Recursive traversal from the entry point, plus any constants which
+  # look like code pointers.
+  instructions = {}
+  leaders = {0}
+  todo = [0]
+  tables = set()
+  while todo:
+    addr = todo.pop()
+    while addr not in instructions:
+      inst = _try_decode(c, addr, length)
+      if inst is None:
+        break
+      instructions[addr] = inst
+
+      pointer = _pointer_constant(inst)
+      if (pointer is not None and pointer not in instructions and
+            _try_decode(c, pointer, length) is not None):
+        leaders.add(pointer)
+        todo.append(pointer)
+
+      if inst.op.code in JUMPS:
+        if inst.modes[1] == 1:
+          leaders.add(inst.params[1])
+          todo.append(inst.params[1])
+        if inst.modes[0] == 1 and (inst.params[0] != 0) == (inst.op.code == 5):
+          # Always taken; nothing falls through.
+          break
+        leaders.add(inst.next_ip)
+
+      if inst.op.code == 99:
+        break
+      addr = inst.next_ip
+
+    if not todo:
+      # A jump whose operand is patched by the program is a computed
+      # jump through the table of code addresses following it.
+      for jump in _patched_jumps(instructions) - tables:
+        tables.add(jump)
+        for entry in _jump_table(c, instructions[jump].next_ip, length):
+          leaders.add(entry)
+          todo.append(entry)
+
+  code = {
+    addr for ip, inst in instructions.items()
+    for addr in range(ip, inst.next_ip)}
+
+  # Flag writes into code and jumps to computed targets.
+  indirect_jumps = []
+  self_modifying = []
+  dynamic_writes = []
+  for addr, inst in sorted(instructions.items()):
+    if inst.op.code in JUMPS and inst.modes[1] != 1:
+      indirect_jumps.append(addr)
+    if inst.op.code in WRITERS:
+      mode = inst.modes[-1]
+      target = inst.params[-1]
+      if mode == 0:
+        if target in code:
+          self_modifying.append((addr, target))
+      else:
+        dynamic_writes.append(addr)
+
+  # Split into basic blocks.
+  leaders = sorted(l for l in leaders if l in instructions)
+  blocks = {}
+  for start in leaders:
+    block = BasicBlock(start, start, [])
+    addr = start
+    while addr in instructions:
+      inst = instructions[addr]
+      block.instructions.append(addr)
+      addr = inst.next_ip
+      if inst.op.code in TERMINATORS or addr in leaders:
+        break
+    block.end = addr
+    blocks[start] = block
+
+  for block in blocks.values():
+    last = instructions[block.instructions[-1]]
+    if last.op.code == 99:
+      continue
+
+    if last.op.code in JUMPS:
+      if last.modes[1] == 1:
+        block.successors.append(last.params[1])
+      else:
+        block.indirect = True
+      always = (
+        last.modes[0] == 1 and
+        (last.params[0] != 0) == (last.op.code == 5))
+      if not always and block.end in blocks:
+        block.successors.append(block.end)
+    elif block.end in blocks:
+      block.successors.append(block.end)
+
+  back_edges = [
+    (block.start, succ)
+    for block in blocks.values()
+    for succ in block.successors
+    if succ <= block.start]
+
+  return Analysis(
+    length,
+    instructions,
+    blocks,
+    indirect_jumps,
+    self_modifying,
+    dynamic_writes,
+    back_edges)
+
+
+def _format_operand(mode: int, param: int) -> str:
+  if mode == 0:
+    return "[{}]".format(param)
+  elif mode == 1:
+    return str(param)
+  elif param < 0:
+    return "[rb-{}]".format(-param)
+  else:
+    return "[rb+{}]".format(param)
+
+
+def format_instruction(inst: computer.Instruction) -> str:
+  return " ".join(
+    [inst.op.name] +
+    [", ".join(_format_operand(m, p) for m, p in zip(inst.modes, inst.params))])
+
+
+def format_listing(analysis: Analysis, values: Sequence[int]) -> str:
+  """
+  Format a disassembly listing, with data shown as raw values.
+
+  """
+  self_modifying = {addr for addr, _ in analysis.self_modifying}
+  indirect = set(analysis.indirect_jumps)
+  headers = set(analysis.loop_headers)
+
+  lines = []
+  addr = 0
+  while addr < analysis.length:
+    inst = analysis.instructions.get(addr)
+    if inst is None:
+      lines.append("{:>6}:   data {}".format(addr, values[addr]))
+      addr += 1
+      continue
+
+    if addr in analysis.blocks:
+      label = "block_{}".format(addr)
+      if addr in headers:
+        label += "  (loop)"
+      lines.append(label + ":")
+
+    notes = []
+    if addr in self_modifying:
+      notes.append("writes code")
+    if addr in indirect:
+      notes.append("indirect jump")
+    lines.append("{:>6}:   {}{}".format(
+      addr,
+      format_instruction(inst),
+      "  ; " + ", ".join(notes) if notes else ""))
+    addr = inst.next_ip
+
+  return "\n".join(lines)
+
+
+def format_blocks(analysis: Analysis) -> str:
+  """
+  Format a summary of the basic blocks and the edges between them.
+
+  """
+  headers = set(analysis.loop_headers)
+  lines = []
+  for start, block in sorted(analysis.blocks.items()):
+    succs = ", ".join(str(s) for s in block.successors)
+    if block.indirect:
+      succs = (succs + ", " if succs else "") + "?"
+    lines.append("{:>6}-{:<6} {:>3} instrs -> {}{}".format(
+      block.start,
+      block.end,
+      len(block.instructions),
+      succs or "exit",
+      "  (loop)" if start in headers else ""))
+
+  lines.append("")
+  lines.append("Instructions: {}".format(len(analysis.instructions)))
+  lines.append("Blocks: {}".format(len(analysis.blocks)))
+  lines.append("Data ranges: {}".format(len(analysis.data_ranges)))
+  lines.append("Indirect jumps: {}".format(len(analysis.indirect_jumps)))
+  lines.append("Self-modifying writes: {}".format(len(analysis.self_modifying)))
+  lines.append("Dynamic writes: {}".format(len(analysis.dynamic_writes)))
+  lines.append("Loops: {}".format(len(headers)))
+  return "\n".join(lines)
+
+
+def format_dot(analysis: Analysis) -> str:
+  """
+  Format the control-flow graph in Graphviz dot format.
+
+  """
+  lines = ["digraph intcode {", "  node [shape=box];"]
+  for start, block in sorted(analysis.blocks.items()):
+    lines.append('  b{} [label="{}-{}"];'.format(start, start, block.end))
+    for succ in block.successors:
+      lines.append("  b{} -> b{};".format(start, succ))
+    if block.indirect:
+      lines.append('  b{} -> indirect [style=dashed];'.format(start))
+  lines.append("}")
+  return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+  parser = argparse.ArgumentParser(
+    prog="python -m aoc.intcode_analysis",
+    description="Disassemble and analyze an Intcode program.")
+  parser.add_argument(
+    "program", help="puzzle number, or path to a program file")
+  output = parser.add_mutually_exclusive_group()
+  output.add_argument(
+    "--blocks", action="store_true", help="summarize the basic blocks")
+  output.add_argument(
+    "--dot", action="store_true", help="output the CFG in dot format")
+  output.add_argument(
+    "--json", action="store_true", help="output the analysis as JSON")
+  args = parser.parse_args(argv)
+
+  if os.path.exists(args.program):
+    with open(args.program) as f:
+      text = f.read()
+  else:
+    text = utils.load_input(int(args.program))
+
+  image = program.load_program(text)
+  analysis = analyze(image)
+
+  if args.blocks:
+    print(format_blocks(analysis))
+  elif args.dot:
+    print(format_dot(analysis))
+  elif args.json:
+    print(json.dumps(analysis.to_dict(), indent=2))
+  else:
+    print(format_listing(analysis, image.values))
+
+
+if __name__ == "__main__":
+  main()
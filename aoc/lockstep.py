@@ -0,0 +1,218 @@
+"""
+Lockstep engine running many copies of one Intcode program on numpy arrays.
+
+Every lane has its own row of memory, IP, relative base and inputs. Lanes
+at the same IP are stepped together with vector operations. When lanes
+diverge, the group at the lowest IP is stepped first, so lanes which fall
+behind catch up and merge with the others again.
+
+All values are held as int64, so programs whose values overflow 64 bits
+are not supported.
+
+"""
+from typing import *
+
+import numpy
+
+from . import program
+from .computer import InvalidAddress, InvalidOpCode, OPERATIONS
+
+
+__all__ = (
+  "LockstepComputer",
+  "run_lockstep",
+)
+
+
+class LockstepComputer:
+  """
+  Runs one copy of a program per sequence of inputs, in lockstep.
+
+  """
+  # Extra memory columns allocated past the end of the program.
+  HEADROOM = 256
+
+  def __init__(
+      self,
+      program_text: Union[str, Sequence[int], program.ProgramImage],
+      input_sequences: Sequence[Sequence[int]]):
+    if isinstance(program_text, str):
+      program_text = program.load_program(program_text)
+    if isinstance(program_text, program.ProgramImage):
+      program_text = program_text.values
+    values = numpy.array(program_text, dtype=numpy.int64)
+
+    lanes = len(input_sequences)
+    self.memory = numpy.zeros(
+      (lanes, len(values) + self.HEADROOM), dtype=numpy.int64)
+    self.memory[:, :len(values)] = values
+
+    self.ip = numpy.zeros(lanes, dtype=numpy.int64)
+    self.rel_base = numpy.zeros(lanes, dtype=numpy.int64)
+
+    longest = max((len(inputs) for inputs in input_sequences), default=0)
+    self.inputs = numpy.zeros((lanes, max(longest, 1)), dtype=numpy.int64)
+    for lane, inputs in enumerate(input_sequences):
+      self.inputs[lane, :len(inputs)] = inputs
+    self.input_lengths = numpy.array(
+      [len(inputs) for inputs in input_sequences], dtype=numpy.int64)
+    self.input_pos = numpy.zeros(lanes, dtype=numpy.int64)
+
+    # Lanes which have neither exited nor run out of input.
+    self.running = numpy.ones(lanes, dtype=bool)
+    self.halted = numpy.zeros(lanes, dtype=bool)
+    self.outputs = [[] for _ in range(lanes)]
+
+    # Number of vector steps taken.
+    self.steps = 0
+
+  def ensure_size(self, size: int):
+    """
+    Grow memory so that every lane has at least `size` cells.
+
+    """
+    current = self.memory.shape[1]
+    if size > current:
+      extra = max(size, 2 * current) - current
+      self.memory = numpy.pad(self.memory, ((0, 0), (0, extra)))
+
+  def addresses(self, lanes, mode: int, params):
+    if mode == 0:
+      addrs = params
+    elif mode == 2:
+      addrs = self.rel_base[lanes] + params
+    else:
+      raise ValueError("No address for immediate mode")
+
+    if addrs.min() < 0:
+      raise InvalidAddress("Address negative", int(addrs.min()))
+    self.ensure_size(int(addrs.max()) + 1)
+    return addrs
+
+  def read(self, lanes, mode: int, params):
+    if mode == 1:
+      return params
+    return self.memory[lanes, self.addresses(lanes, mode, params)]
+
+  def write(self, lanes, mode: int, params, values):
+    self.memory[lanes, self.addresses(lanes, mode, params)] = values
+
+  def execute(self, lanes, ip: int, opdata: int):
+    """
+    Execute the instruction `opdata` at `ip` for each of `lanes`.
+
+    """
+    op = OPERATIONS.get(opdata % 100)
+    if op is None:
+      raise InvalidOpCode("Invalid op code: {}".format(opdata))
+    modes = [(opdata // 10 ** (pos + 1)) % 10 for pos in range(1, op.params + 1)]
+
+    self.ensure_size(ip + 1 + op.params)
+    params = self.memory[lanes, ip + 1:ip + 1 + op.params]
+
+    if op.code in (1, 2, 7, 8):
+      a = self.read(lanes, modes[0], params[:, 0])
+      b = self.read(lanes, modes[1], params[:, 1])
+      if op.code == 1:
+        values = a + b
+      elif op.code == 2:
+        values = a * b
+      elif op.code == 7:
+        values = (a < b).astype(numpy.int64)
+      else:
+        values = (a == b).astype(numpy.int64)
+      self.write(lanes, modes[2], params[:, 2], values)
+
+    elif op.code == 3:
+      # Lanes without any input left stop here, without executing it.
+      available = self.input_pos[lanes] < self.input_lengths[lanes]
+      self.running[lanes[~available]] = False
+      lanes = lanes[available]
+      params = params[available]
+      if len(lanes) == 0:
+        return
+
+      values = self.inputs[lanes, self.input_pos[lanes]]
+      self.input_pos[lanes] += 1
+      self.write(lanes, modes[0], params[:, 0], values)
+
+    elif op.code == 4:
+      values = self.read(lanes, modes[0], params[:, 0])
+      for lane, value in zip(lanes.tolist(), values.tolist()):
+        self.outputs[lane].append(value)
+
+    elif op.code in (5, 6):
+      cond = self.read(lanes, modes[0], params[:, 0])
+      jump = cond != 0 if op.code == 5 else cond == 0
+      next_ips = numpy.full(len(lanes), ip + 1 + op.params, dtype=numpy.int64)
+      # Only lanes which jump read the target, as on a single computer.
+      if jump.any():
+        next_ips[jump] = self.read(lanes[jump], modes[1], params[jump, 1])
+      self.ip[lanes] = next_ips
+      return
+
+    elif op.code == 9:
+      self.rel_base[lanes] += self.read(lanes, modes[0], params[:, 0])
+
+    elif op.code == 99:
+      self.running[lanes] = False
+      self.halted[lanes] = True
+      return
+
+    self.ip[lanes] = ip + 1 + op.params
+
+  def step(self) -> bool:
+    """
+    Step the running lanes at the lowest IP by one instruction.
+
+    Returns False if no lanes are left running.
+
+    """
+    running = numpy.flatnonzero(self.running)
+    if len(running) == 0:
+      return False
+
+    ips = self.ip[running]
+    ip = int(ips.min())
+    lanes = running[ips == ip]
+    self.ensure_size(ip + 1)
+    opdata = self.memory[lanes, ip]
+
+    if (opdata == opdata[0]).all():
+      self.execute(lanes, ip, int(opdata[0]))
+    else:
+      # Lanes have modified the code differently.
+      for value in numpy.unique(opdata).tolist():
+        self.execute(lanes[opdata == value], ip, value)
+
+    self.steps += 1
+    return True
+
+  def run(self) -> List[List[int]]:
+    """
+    Run every lane until it exits or runs out of input.
+
+    Returns the outputs of each lane.
+
+    """
+    while self.step():
+      pass
+    return self.outputs
+
+
+def run_lockstep(
+    program_text: Union[str, Sequence[int], program.ProgramImage],
+    input_sequences: Sequence[Sequence[int]],
+    max_lanes: int = 10000) -> List[List[int]]:
+  """
+  Run a program once per sequence of inputs, returning the outputs of each.
+
+  Lanes are run in chunks of at most `max_lanes` to bound memory use.
+
+  """
+  outputs = []
+  for start in range(0, len(input_sequences), max_lanes):
+    c = LockstepComputer(
+      program_text, input_sequences[start:start + max_lanes])
+    outputs.extend(c.run())
+  return outputs
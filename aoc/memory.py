@@ -0,0 +1,167 @@
+import array
+from typing import *
+
+
+__all__ = (
+  "PagedMemory",
+  "ReadOnlyMemory",
+)
+
+
+PAGE_BITS = 10
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+
+_ZERO_PAGE = array.array("q", bytes(8 * PAGE_SIZE))
+
+
+def _typed_page(values: Sequence[int]):
+  """
+  Return a page holding `values`, as an int64 array if they all fit.
+
+  """
+  try:
+    return array.array("q", values)
+  except OverflowError:
+    return list(values)
+
+
+def _copy_page(page):
+  if isinstance(page, memoryview):
+    copy = array.array("q")
+    copy.frombytes(page.cast("B"))
+    return copy
+  return page[:]
+
+
+class PagedMemory:
+  """
+  Sparse, unbounded Intcode memory.
+
+  Memory is split into fixed-size pages which are only allocated when
+  first written to. Reading from a page that has never been written
+  returns 0.
+
+  If `typed` is set, pages are stored as int64 arrays, which take a
+  fraction of the space of lists and copy with a single memcpy. A page is
+  converted to a list of Python ints if a value which doesn't fit in 64
+  bits is written to it.
+
+  Pages may be shared between copies of the memory; a shared page is only
+  copied when one of the copies writes to it.
+
+  """
+  def __init__(
+      self, values: Optional[Sequence[int]] = None, typed: bool = True):
+    self.pages = {}
+    # Indices of pages which this memory may modify in place.
+    self.owned = set()
+    self.typed = typed
+    # The `ProgramImage` this memory was copied from, if any.
+    self.image = None
+    if values is not None:
+      self.load(values)
+
+  def copy(self) -> "PagedMemory":
+    """
+    Return a copy-on-write copy of this memory.
+
+    """
+    clone = PagedMemory(typed=self.typed)
+    clone.pages = dict(self.pages)
+    clone.image = self.image
+    # All pages are now shared, so neither copy owns them. The set is
+    # cleared in place as compiled code may hold a reference to it.
+    self.owned.clear()
+    return clone
+
+  def load(self, values: Sequence[int]):
+    """
+    Copy `values` into memory, starting at address 0.
+
+    """
+    values = list(values)
+    for index, start in enumerate(range(0, len(values), PAGE_SIZE)):
+      page = values[start:start + PAGE_SIZE]
+      if len(page) < PAGE_SIZE:
+        page.extend([0] * (PAGE_SIZE - len(page)))
+      self.pages[index] = _typed_page(page) if self.typed else page
+      self.owned.add(index)
+
+  def promote(self, index: int) -> List[int]:
+    """
+    Convert page `index` to a list of Python ints, so it can hold any value.
+
+    """
+    page = list(self.pages[index])
+    self.pages[index] = page
+    self.owned.add(index)
+    return page
+
+  def __getitem__(self, addr):
+    try:
+      return self.pages[addr >> PAGE_BITS][addr & PAGE_MASK]
+
+    except KeyError:
+      if addr < 0:
+        raise IndexError("Address negative", addr)
+      return 0
+
+    except TypeError:
+      if not isinstance(addr, slice):
+        raise
+      if addr.stop is None:
+        raise ValueError("Slice of unbounded memory needs a stop")
+      return [self[i] for i in range(addr.start or 0, addr.stop, addr.step or 1)]
+
+  def __setitem__(self, addr: int, value: int):
+    index = addr >> PAGE_BITS
+    if index in self.owned:
+      try:
+        self.pages[index][addr & PAGE_MASK] = value
+      except OverflowError:
+        self.promote(index)[addr & PAGE_MASK] = value
+      return
+
+    if addr < 0:
+      raise IndexError("Address negative", addr)
+
+    page = self.pages.get(index)
+    if page is None:
+      page = _ZERO_PAGE[:] if self.typed else [0] * PAGE_SIZE
+    else:
+      # Shared pages may be read-only views, such as of a checkpoint file.
+      page = _copy_page(page)
+    try:
+      page[addr & PAGE_MASK] = value
+    except OverflowError:
+      page = list(page)
+      page[addr & PAGE_MASK] = value
+    self.pages[index] = page
+    self.owned.add(index)
+
+
+class ReadOnlyMemory(PagedMemory):
+  """
+  `PagedMemory` which can't be written to, only copied.
+
+  Copies are ordinary `PagedMemory` objects sharing its pages, so can be
+  written to without affecting it.
+
+  """
+  def __init__(
+      self, values: Optional[Sequence[int]] = None, typed: bool = True):
+    super().__init__(typed=typed)
+    if values is not None:
+      super().load(values)
+    # Nothing may write to the pages in place.
+    self.owned.clear()
+
+  def load(self, values: Sequence[int]):
+    raise TypeError("Memory is read-only")
+
+  def promote(self, index: int) -> List[int]:
+    raise TypeError("Memory is read-only")
+
+  def __setitem__(self, addr: int, value: int):
+    raise TypeError("Memory is read-only")
@@ -12,7 +12,7 @@ def solve_a(inp):
 def solve_b(inp):
   mem = [int(x) for x in inp.split(",")]
 
-  c = computer.Computer(mem)
+  c = computer.Computer(mem, compiled=True)
   c.run(input_fn=lambda: 2)
 
 
@@ -1,28 +1,26 @@
-from . import async_computer
+from . import computer
+from . import lockstep
+from . import tractor_beam
 from . import utils
 
 
+# Beam queries for each program seen, by program text.
+_queries = {}
+
+
 def solve_a(inp):
-  count = 0
-  for x in range(50):
-    for y in range(50):
-      c = async_computer.Computer()
-      c.init_memory_from_string(inp)
-      c.run_async()
-      c.send(x)
-      c.send(y)
-      count += c.get()
+  probes = [(x, y) for x in range(50) for y in range(50)]
+  count = sum(
+    outputs[0] for outputs in lockstep.run_lockstep(inp, probes))
 
   print(count)
 
 
 def get_beam(x, y, inp):
-  c = async_computer.Computer()
-  c.init_memory_from_string(inp)
-  c.run_async()
-  c.send(x)
-  c.send(y)
-  return c.get()
+  query = _queries.get(inp)
+  if query is None:
+    query = _queries[inp] = computer.PureQuery(inp)
+  return query(x, y)[0]
 
 
 def get_beam_map_full(max_x, max_y, inp):
@@ -33,54 +31,12 @@ def get_beam_map_full(max_x, max_y, inp):
   return beam_map
 
 
-def get_beams_minimal(max_y, max_width, inp):
-  # Find the first and last x co-ord for each y value.
-  # Assume the beam moves at most 1 square to the right for
-  # min and max, and never moves left.
-  # Ignore the missing beams in the first few rows.
-  beams = []
-
-  if max_y is None:
-    max_y = int(1e6)
-
-  if max_width is None:
-    max_width = int(1e3)
-
-  # First row always has a single beam in.
-  beams.append((0, 0))
-
-  y = 1
-  width = 1
-  while y < max_y and width < max_width:
-    min_x = beams[y-1][0]
-    # Try the same min as as the previous row.
-    val = get_beam(min_x, y, inp)
-    if val == 0:
-      min_x += 1
-
-    # Try the next max from the previous row.
-    max_x = beams[y-1][1]
-    val = get_beam(max_x + 1, y, inp)
-    if val == 1:
-      max_x += 1
-    
-    beams.append((min_x, max_x))
-    y += 1
-    width = max_x - min_x
-
-  return beams
-
-
-def solve_b(inp):
-  beams = get_beams_minimal(None, 250, inp)
+def solve_b(inp, size=100):
+  beam = tractor_beam.Beam(inp)
+  x, y = beam.fit_square(size)
 
-  for i, beam in enumerate(beams):
-    if beams[i + 99][0] <= beam[1] - 99:
-      print(i)
-      print(beams[i][0], beam[1])
-      print(beams[i+99][0], beams[i+99][1])
-      print(beam[1] - 99, i)
-      break
+  print(x, y)
+  print(10000 * x + y)
 
 
 def run():
@@ -0,0 +1,109 @@
+"""
+Execution profiles for Intcode computers.
+
+Enable with `BaseComputer.enable_profiling()`. While enabled, the computer
+runs a separate instrumented loop, so a computer without a profile pays
+nothing for it.
+
+"""
+import collections
+import json
+from typing import *
+
+
+__all__ = (
+  "Profile",
+)
+
+
+MODE_NAMES = {0: "P", 1: "I", 2: "R"}
+
+
+class Profile:
+  """
+  Counts of what a computer executed.
+
+  A single profile can be shared between several computers to aggregate
+  their counts.
+
+  """
+  def __init__(self):
+    # Executions of each IP.
+    self.ip_counts = collections.Counter()
+    # Executions of each (operation name, operand modes) pair.
+    self.op_mode_counts = collections.Counter()
+    self.inputs = 0
+    self.outputs = 0
+    # Number of times the computer stopped because no input was available.
+    self.input_waits = 0
+    # Seconds spent running, and the part of that spent waiting on input.
+    self.elapsed = 0.0
+    self.input_time = 0.0
+
+  @property
+  def instructions(self) -> int:
+    return sum(self.ip_counts.values())
+
+  @property
+  def op_counts(self) -> Counter:
+    counts = collections.Counter()
+    for (name, _), count in self.op_mode_counts.items():
+      counts[name] += count
+    return counts
+
+  @property
+  def instructions_per_second(self) -> float:
+    busy = self.elapsed - self.input_time
+    if busy <= 0:
+      return 0.0
+    return self.instructions / busy
+
+  def to_dict(self, top: int = 20) -> Dict[str, Any]:
+    return {
+      "instructions": self.instructions,
+      "elapsed": self.elapsed,
+      "input_time": self.input_time,
+      "instructions_per_second": self.instructions_per_second,
+      "inputs": self.inputs,
+      "outputs": self.outputs,
+      "input_waits": self.input_waits,
+      "ops": dict(self.op_counts.most_common()),
+      "modes": {
+        "{} {}".format(name, "".join(MODE_NAMES[m] for m in modes)): count
+        for (name, modes), count in self.op_mode_counts.most_common()
+      },
+      "hot_ips": [
+        [ip, count] for ip, count in self.ip_counts.most_common(top)],
+    }
+
+  def to_json(self, top: int = 20, **kwargs) -> str:
+    return json.dumps(self.to_dict(top), **kwargs)
+
+  def report(self, top: int = 20) -> str:
+    """
+    Format the profile as a plain text table.
+
+    """
+    total = self.instructions or 1
+    lines = [
+      "Instructions: {}".format(self.instructions),
+      "Elapsed: {:.3f}s ({:.3f}s waiting for input)".format(
+        self.elapsed, self.input_time),
+      "Instructions/sec: {:.0f}".format(self.instructions_per_second),
+      "Inputs: {}  Outputs: {}  Input waits: {}".format(
+        self.inputs, self.outputs, self.input_waits),
+      "",
+      "{:<40} {:>12} {:>7}".format("Op (modes)", "Count", "%"),
+    ]
+    for (name, modes), count in self.op_mode_counts.most_common():
+      name = "{} {}".format(name, "".join(MODE_NAMES[m] for m in modes))
+      lines.append("{:<40} {:>12} {:>6.2f}%".format(
+        name, count, 100 * count / total))
+
+    lines.append("")
+    lines.append("{:<40} {:>12} {:>7}".format("IP", "Count", "%"))
+    for ip, count in self.ip_counts.most_common(top):
+      lines.append("{:<40} {:>12} {:>6.2f}%".format(
+        ip, count, 100 * count / total))
+
+    return "\n".join(lines)
@@ -0,0 +1,87 @@
+import dataclasses
+import hashlib
+import warnings
+from typing import *
+
+from .memory import ReadOnlyMemory
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+else:
+  _INT64 = numpy.iinfo(numpy.int64)
+
+
+__all__ = (
+  "ProgramImage",
+  "clear_cache",
+  "load_program",
+  "parse_program",
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class ProgramImage:
+  """
+  A parsed Intcode program.
+
+  `memory` is read-only. Computers adopt it by taking a copy-on-write copy,
+  so the program is neither re-parsed nor copied.
+
+  """
+  digest: str
+  values: Tuple[int, ...]
+  memory: ReadOnlyMemory = dataclasses.field(repr=False, compare=False)
+
+  def __len__(self):
+    return len(self.values)
+
+
+# Parsed images, keyed by the SHA-1 of the program text.
+_CACHE: Dict[str, ProgramImage] = {}
+
+
+def parse_program(text: str) -> List[int]:
+  """
+  Parse a comma-separated Intcode program.
+
+  """
+  text = text.strip()
+  if numpy is not None:
+    with warnings.catch_warnings():
+      # numpy warns, rather than raising, at anything it can't parse.
+      warnings.simplefilter("error")
+      try:
+        values = numpy.fromstring(text, dtype=numpy.int64, sep=",")
+      except (ValueError, DeprecationWarning):
+        values = None
+
+    # Check numpy got everything, and that nothing was clamped to fit in
+    # an int64, before trusting it.
+    if (values is not None and
+          len(values) == text.count(",") + 1 and
+          values.max() < _INT64.max and
+          values.min() > _INT64.min):
+      return values.tolist()
+
+  return list(map(int, text.split(",")))
+
+
+def load_program(text: str) -> ProgramImage:
+  """
+  Return the image for a program, parsing it only the first time it is seen.
+
+  """
+  digest = hashlib.sha1(text.encode()).hexdigest()
+  image = _CACHE.get(digest)
+  if image is None:
+    values = parse_program(text)
+    memory = ReadOnlyMemory(values)
+    image = ProgramImage(digest, tuple(values), memory)
+    _CACHE[digest] = image
+  return image
+
+
+def clear_cache():
+  _CACHE.clear()
@@ -1,50 +1,164 @@
 import itertools
 import queue
+from typing import *
 
 from . import async_computer
 from . import computer
+from . import program
 from . import utils
 
 
-def try_with_input(input1, input2, memory):
-  c = computer.Computer(memory)
-
-  input_fn_called_count = 0
-  def input_fn():
-    nonlocal input_fn_called_count
-    if input_fn_called_count == 0:
-      input_fn_called_count += 1
-      return input1
-    else:
-      return input2
-
-  output = None
-  def output_fn(out):
-    nonlocal output
-    output = out
-
-  c.run(input_fn, output_fn)
-
-  return output
+class AmplifierChain:
+  """
+  Amplifiers connected in a feedback loop, run in a single thread.
+
+  Each amplifier's outputs go straight onto the input list of the next,
+  and the last feeds back into the first. The amplifiers take turns, in
+  order, each running until it needs input it doesn't have, so the run is
+  deterministic.
+
+  """
+  def __init__(self, computers, halted=None):
+    self.computers = list(computers)
+    # Values waiting to be input to each amplifier.
+    self.inputs = [[] for _ in self.computers]
+    self.halted = list(halted or [False] * len(self.computers))
+    # Last signal output by the final amplifier.
+    self.last_signal = None
+
+  def run(self, signals=(0,)):
+    """
+    Input `signals` to the first amplifier and run until every amplifier
+    halts, returning the last signal output by the final amplifier.
+
+    """
+    num_amps = len(self.computers)
+    self.inputs[0].extend(signals)
+
+    while not all(self.halted):
+      progressed = False
+      for i, c in enumerate(self.computers):
+        if self.halted[i]:
+          continue
+
+        outputs, state = c.run_until_blocked(self.inputs[i])
+        self.inputs[i] = []
+        if state is computer.State.HALTED:
+          self.halted[i] = True
+          progressed = True
+
+        if outputs:
+          progressed = True
+          self.inputs[(i + 1) % num_amps].extend(outputs)
+          if i == num_amps - 1:
+            self.last_signal = outputs[-1]
+
+      if not progressed:
+        raise RuntimeError("Amplifiers are all waiting for input")
+
+    return self.last_signal
+
+
+class PhaseSearch:
+  """
+  Search every order of a set of phases for the highest final signal.
+
+  The orders are walked depth-first as a tree, where each node runs one
+  more amplifier on the signals output by its parent. An amplifier's
+  outputs depend only on its phase and the signals it is given, so each
+  (phase, signals) stage is run once and memoized, and the orders sharing a
+  prefix share its stages. `runs` counts the stages run.
+
+  With `feedback` set, a stage is the amplifier's first pass: it runs until
+  it needs more input, and a snapshot of it is memoized with its outputs.
+  Each complete order then resumes its amplifiers from their snapshots and
+  runs the feedback loop to the end.
+
+  """
+  def __init__(self, image, phases: Iterable[int], feedback: bool = False):
+    self.phases = tuple(phases)
+    self.feedback = feedback
+    self.start = computer.Computer(image).snapshot()
+    # (phase, signals) -> (outputs, snapshot, or None if it halted)
+    self.stages = {}
+    self.runs = 0
+    self.best_signal = None
+    self.best_order = ()
+
+  def stage(
+      self, phase: int, signals: Tuple[int, ...]
+  ) -> Tuple[Tuple[int, ...], Optional[computer.Snapshot]]:
+    key = (phase, signals)
+    result = self.stages.get(key)
+    if result is None:
+      c = computer.Computer()
+      c.restore(self.start)
+      outputs, state = c.run_until_blocked((phase,) + signals)
+      self.runs += 1
+
+      snapshot = None
+      if self.feedback and state is not computer.State.HALTED:
+        snapshot = c.snapshot()
+      result = self.stages[key] = (tuple(outputs), snapshot)
+    return result
+
+  def finish(
+      self, signals: Tuple[int, ...],
+      snapshots: List[Optional[computer.Snapshot]]) -> Optional[int]:
+    """
+    Run the feedback loop to the end from the amplifiers' first passes.
+
+    """
+    computers = []
+    for snapshot in snapshots:
+      c = computer.Computer()
+      if snapshot is not None:
+        c.restore(snapshot)
+      computers.append(c)
+
+    chain = AmplifierChain(computers, [s is None for s in snapshots])
+    if signals:
+      chain.last_signal = signals[-1]
+    return chain.run(signals)
+
+  def visit(
+      self, order: Tuple[int, ...], remaining: Tuple[int, ...],
+      signals: Tuple[int, ...], snapshots: List[Optional[computer.Snapshot]]):
+    if not remaining:
+      if self.feedback:
+        signal = self.finish(signals, snapshots)
+      else:
+        signal = signals[-1] if signals else None
+
+      if signal is not None and (
+          self.best_signal is None or signal > self.best_signal):
+        self.best_signal = signal
+        self.best_order = order
+      return
+
+    for i, phase in enumerate(remaining):
+      outputs, snapshot = self.stage(phase, signals)
+      self.visit(
+        order + (phase,), remaining[:i] + remaining[i + 1:],
+        outputs, snapshots + [snapshot])
+
+  def search(self, signal: int = 0) -> Tuple[Optional[int], Tuple[int, ...]]:
+    """
+    Return the highest final signal, and the order of phases giving it.
+
+    """
+    self.visit((), self.phases, (signal,), [])
+    return self.best_signal, self.best_order
 
 
 def solve_a(inp):
-  base_mem = [int(x) for x in inp.split(",")]
-
-  perms = itertools.permutations([0, 1, 2, 3, 4])
-  max_amplification = 0
-  for perm in perms:
-    last_output = 0
-    for phase in perm:
-      last_output = try_with_input(phase, last_output, base_mem)
-
-    if last_output > max_amplification:
-      max_amplification = last_output
-  
+  base_mem = program.load_program(inp)
+
+  max_amplification, _ = PhaseSearch(base_mem, [0, 1, 2, 3, 4]).search()
   print(max_amplification)
 
 
-def try_with_phases(base_mem, phases):
+def try_with_phases_threaded(base_mem, phases):
   # Set up the computers and queues such that each output leads into
   # the next input.
   queues = [queue.Queue() for i in range(5)]
@@ -76,16 +190,24 @@ def try_with_phases(base_mem, phases):
 
 
 def solve_b(inp):
-  base_mem = [int(x) for x in inp.split(",")]
+  base_mem = program.load_program(inp)
+
+  search = PhaseSearch(base_mem, [5, 6, 7, 8, 9], feedback=True)
+  max_output, _ = search.search()
+  print(max_output)
+
+
+def solve_b_threaded(inp):
+  base_mem = program.load_program(inp)
 
   perms = itertools.permutations([5, 6, 7, 8, 9])
   max_output = 0
   for phases in perms:
-    output = try_with_phases(base_mem, phases)
+    output = try_with_phases_threaded(base_mem, phases)
     max_output = max(output, max_output)
-  
+
   print(max_output)
-  
+
 
 def run():
   #solve_a(utils.load_input(7))
@@ -1,5 +1,3 @@
-import queue
-
 from . import async_computer
 from . import computer
 from . import utils
@@ -41,43 +39,26 @@ def solve_a(inp):
   print(intersection_sum)
 
 
-def solve_b(inp):
-  # Figured out manually.
-  instructions = [
-    "A,B,A,B,A,C,B,C,A,C",   # Main routine
-    "L,6,R,12,L,6",          # Function A
-    "R,12,L,10,L,4,L,6",     # Function B
-    "L,10,L,10,L,4,L,6",     # Function C 
-    "n",                     # Continuous video feed?
-  ]
+# Figured out manually.
+MOVEMENT_ROUTINE = [
+  "A,B,A,B,A,C,B,C,A,C",   # Main routine
+  "L,6,R,12,L,6",          # Function A
+  "R,12,L,10,L,4,L,6",     # Function B
+  "L,10,L,10,L,4,L,6",     # Function C 
+  "n",                     # Continuous video feed?
+]
+
 
+def solve_b(inp):
   c = async_computer.Computer()
   c.init_memory_from_string(inp)
   c.memory[0] = 2
-  c.run_async()
-
-  # Line up all the input in the queue.
-  for inst in instructions:
-    for char in inst:
-      c.send(ord(char))
-    c.send(ord("\n"))
-
-  while not c.finished_event.isSet():
-    output = c.get()
-    if output <= 255:
-      print(chr(output), end="")
-    else:
-      print(f"Integer: {output}")
 
-  # Get any remaining output.
-  # Foibles of async design :(
-  # Maybe should prevent computer exiting until all output read.
-  while True:
-    try:
-      output = c.get(block=False)
-    except queue.Empty:
-      break
+  # Line up all the input.
+  inputs = [ord(char) for inst in MOVEMENT_ROUTINE for char in inst + "\n"]
 
+  for output in c.run_generator(inputs):
+    assert output is not None, "Ran out of input"
     if output <= 255:
       print(chr(output), end="")
     else:
@@ -1,6 +1,4 @@
-import queue
-
-from . import async_computer
+from . import computer
 from . import utils
 
 
@@ -31,19 +29,31 @@ def print_tiles(tile_dict):
     print()
 
 
+def update_tiles(tiles, outputs):
+  """
+  Apply a batch of (x, y, tile ID) outputs to the tiles.
+
+  Returns the last position each tile ID was drawn at in the batch, not
+  counting the score.
+
+  """
+  drawn = {}
+  for i in range(0, len(outputs), 3):
+    x, y, tid = outputs[i:i + 3]
+    tiles[(x,y)] = tid
+    if x != -1:
+      # Not the score.
+      drawn[tid] = (x, y)
+  return drawn
+
+
 def solve_a(inp):
-  c = async_computer.Computer()
+  c = computer.Computer()
   c.init_memory_from_string(inp)
 
-  c.run_async()
-
   tiles = {}
-
-  while not c.finished_event.isSet():
-    x = c.get()
-    y = c.get()
-    tid = c.get()
-    tiles[(x,y)] = tid
+  outputs, _ = c.run_until_blocked()
+  update_tiles(tiles, outputs)
 
   num_blocks = sum(1 for pos, tid in tiles.items() if tid == 2)
   print(num_blocks)
@@ -54,61 +64,27 @@ def solve_b(inp):
   # Set memory address 0 to 2 to play for free.
   program[0] = 2
 
-  c = async_computer.Computer()
-  c.init_memory(program)
-
-  c.run_async()
+  c = computer.Computer(program)
 
   tiles = {}
-  c.send(0)
-
-  paddle = (0, 0)
-  while True:
-    x = c.get()
-    y = c.get()
-    tid = c.get()
-    tiles[(x,y)] = tid
-
-    if tid == 3:
-      paddle = (x, y)
-    elif tid == 4:
-      ball = (x, y)
-
-    if x == -1:
-      # Got score - end of initialization.
-      break
+  outputs, state = c.run_until_blocked()
+  drawn = update_tiles(tiles, outputs)
+  ball = drawn[4]
+  paddle = drawn[3]
 
   i = 0
-  while not c.finished_event.isSet():
+  while state is computer.State.NEEDS_INPUT:
     if ball[0] < paddle[0]:
-      c.send(-1)
+      joystick = -1
     elif ball[0] > paddle[0]:
-      c.send(1)
+      joystick = 1
     else:
-      c.send(0)
-
-    c.input_queue.join()
-
-    # This timing is all a bit dodgy.
-    # Don't know how may values to get out before sending in another one.
-
-    while True:
-      try:
-        x = c.get(timeout=0.005)
-        y = c.get()
-        tid = c.get()
-
-        tiles[(x,y)] = tid
-
-        if x == -1 and y == 0:
-          print(f"Score {tid}")
+      joystick = 0
 
-        if tid == 3:
-          paddle = (x, y)
-        elif tid == 4:
-          ball = (x, y)
-      except queue.Empty:
-        break
+    outputs, state = c.run_until_blocked([joystick])
+    drawn = update_tiles(tiles, outputs)
+    ball = drawn.get(4, ball)
+    paddle = drawn.get(3, paddle)
 
     i += 1
     if (i % 100) == 0:
@@ -0,0 +1,143 @@
+"""
+Execution traces of Intcode computers.
+
+Enable with `BaseComputer.enable_tracing()`. While enabled, the computer
+runs a separate loop which records every instruction it executes into a
+fixed-size ring buffer, and logs every input value. Together with the state
+the computer was in when tracing started, the input log is enough to replay
+the run exactly:
+
+  trace.save_replay("run.ckpt")
+  ...
+  python -m aoc.tracer run.ckpt --last 50
+
+"""
+import argparse
+import array
+from typing import *
+
+from . import checkpoint
+
+
+__all__ = (
+  "Trace",
+  "TraceEntry",
+)
+
+
+WRITERS = frozenset((1, 2, 3, 7, 8))
+
+
+def _zeros(size: int) -> array.array:
+  return array.array("q", bytes(8 * size))
+
+
+class TraceEntry(NamedTuple):
+  # Number of instructions executed before this one since tracing started.
+  step: int
+  ip: int
+  opdata: int
+  params: Tuple[int, ...]
+  # Value written to memory, or None if the instruction doesn't write.
+  value: Optional[int]
+
+
+class Trace:
+  """
+  Ring buffer of the last `size` instructions a computer executed.
+
+  The buffer is preallocated: IPs and written values are held in int64
+  arrays, and each instruction as a reference to the computer's decoded
+  instruction, which holds its operation, modes and operands. Written
+  values too large for an int64 are kept separately.
+
+  """
+  def __init__(self, size: int = 1 << 20):
+    self.size = size
+    self.ips = _zeros(size)
+    self.instructions = [None] * size
+    self.values = _zeros(size)
+    # Written values which don't fit in `values`, by step.
+    self.overflow = {}
+    # Instructions executed since tracing started.
+    self.steps = 0
+    # Every input value read since tracing started.
+    self.inputs = []
+    # Snapshot of the computer when tracing started.
+    self.start = None
+
+  def entry(self, step: int) -> TraceEntry:
+    index = step % self.size
+    inst = self.instructions[index]
+    opdata = inst.op.code + sum(
+      mode * 10 ** (pos + 2) for pos, mode in enumerate(inst.modes))
+
+    value = None
+    if inst.op.code in WRITERS:
+      value = self.overflow.get(step, self.values[index])
+    return TraceEntry(step, self.ips[index], opdata, inst.params, value)
+
+  def entries(self, last: Optional[int] = None) -> List[TraceEntry]:
+    """
+    Return the recorded entries, oldest first.
+
+    Only the last `size` instructions are kept; pass `last` to return fewer.
+
+    """
+    first = max(0, self.steps - self.size)
+    if last is not None:
+      first = max(first, self.steps - last)
+    # Drop overflowed values which have been overwritten.
+    for step in [s for s in self.overflow if s < first]:
+      del self.overflow[step]
+    return [self.entry(step) for step in range(first, self.steps)]
+
+  def format(self, last: Optional[int] = 20) -> str:
+    lines = []
+    for e in self.entries(last):
+      line = "{:>10}  {:>6}: {:<6} {}".format(
+        e.step, e.ip, e.opdata, ", ".join(str(p) for p in e.params))
+      if e.value is not None:
+        line += "  -> {}".format(e.value)
+      lines.append(line)
+    return "\n".join(lines)
+
+  def save_replay(self, path: str):
+    """
+    Save what is needed to replay the traced run to a checkpoint file.
+
+    The checkpoint holds the computer's state when tracing started, with
+    the logged inputs as its pending inputs. Replay it with
+    `computer.replay`, or from the command line.
+
+    """
+    if self.start is None:
+      raise ValueError("Trace was never started")
+    start = self.start
+    checkpoint.save_checkpoint(
+      path, start.ip, start.rel_base, start.memory, self.inputs)
+
+
+def main(argv: Optional[List[str]] = None):
+  from . import computer
+
+  parser = argparse.ArgumentParser(
+    prog="python -m aoc.tracer",
+    description="Replay a run saved with Trace.save_replay.")
+  parser.add_argument("replay", help="path of the replay checkpoint")
+  parser.add_argument(
+    "--last", type=int, default=20,
+    help="number of trailing instructions to show (default: 20)")
+  args = parser.parse_args(argv)
+
+  trace = Trace(max(args.last, 1))
+  outputs, state = computer.replay(args.replay, trace)
+  print(trace.format(args.last))
+  print()
+  print("Instructions: {}".format(trace.steps))
+  print("Outputs: {}".format(outputs))
+  print("Stopped: {}".format(state.value))
+
+
+if __name__ == "__main__":
+  main()
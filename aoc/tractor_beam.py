@@ -0,0 +1,232 @@
+"""
+Geometry of the tractor beam mapped by a drone program.
+
+The beam is a cone from the origin, so each row of it is an interval of x
+whose edges grow roughly linearly with y. The slopes of the edges are
+estimated from the farthest row found so far, and each new row is found by
+galloping out from its predicted edges, then binary searching, so a row
+costs a handful of probes however wide it is.
+
+"""
+import math
+from typing import *
+
+from . import computer
+from . import program
+
+
+__all__ = (
+  "Beam",
+)
+
+
+# Farthest row `Beam.calibrate` looks for the beam on. It probes about 8
+# times this many cells before giving up.
+MAX_CALIBRATION_ROW = 1024
+
+
+class Beam:
+  """
+  Tractor beam, probed through a drone program.
+
+  Probes go through a `PureQuery`, so the program's setup is run once and
+  no point is probed twice. `runs` counts the times the program was run.
+
+  """
+  def __init__(
+      self,
+      program_text: Union[str, Sequence[int], program.ProgramImage],
+      first_row: int = 10):
+    self.query = computer.PureQuery(program_text)
+    # Interval of x in the beam for each row found, or None if the row is
+    # empty.
+    self.rows: Dict[int, Optional[Tuple[int, int]]] = {}
+    # Farthest non-empty row found, from which the slopes are estimated.
+    self.reference = None
+    self.calibrate(first_row)
+
+  @property
+  def runs(self) -> int:
+    return self.query.misses
+
+  def probe(self, x: int, y: int) -> bool:
+    if x < 0 or y < 0:
+      return False
+    return self.query(x, y)[0] == 1
+
+  def calibrate(self, y: int):
+    """
+    Find a first non-empty row by scanning rows from `y`, doubling it each
+    time the row is empty.
+
+    Raises `ValueError` if there is no beam with x at most 4y on any row up
+    to `MAX_CALIBRATION_ROW`.
+
+    """
+    while self.reference is None:
+      if y > MAX_CALIBRATION_ROW:
+        raise ValueError(
+          "No beam found up to row {}".format(MAX_CALIBRATION_ROW))
+      inside = next((x for x in range(4 * y + 1) if self.probe(x, y)), None)
+      if inside is None:
+        self.rows[y] = None
+        y = max(2 * y, 1)
+      else:
+        self.solve_row(y, inside, inside, inside)
+
+  def slopes(self) -> Tuple[float, float]:
+    """
+    Estimated (left, right) slopes of the edges, as x per row.
+
+    """
+    lo, hi = self.rows[self.reference]
+    return lo / self.reference, hi / self.reference
+
+  def find_edge(self, y: int, inside: int, guess: int, step: int) -> int:
+    """
+    Return the last x in the beam going from `inside` in direction `step`,
+    where the edge is expected to be near `guess`.
+
+    """
+    # Keep the guess on the outward side of `inside`.
+    if (guess - inside) * step < 0:
+      guess = inside
+
+    if self.probe(guess, y):
+      # Gallop outwards until leaving the beam.
+      last_in = guess
+      distance = 1
+      while True:
+        out = guess + step * distance
+        if not self.probe(out, y):
+          break
+        last_in = out
+        distance *= 2
+    else:
+      # Gallop back towards `inside` until entering the beam.
+      out = guess
+      distance = 1
+      while True:
+        last_in = guess - step * distance
+        if (last_in - inside) * step <= 0:
+          last_in = inside
+          break
+        if self.probe(last_in, y):
+          break
+        out = last_in
+        distance *= 2
+
+    while abs(out - last_in) > 1:
+      mid = (last_in + out) // 2
+      if self.probe(mid, y):
+        last_in = mid
+      else:
+        out = mid
+    return last_in
+
+  def solve_row(
+      self, y: int, inside: int, lo_guess: int, hi_guess: int
+  ) -> Tuple[int, int]:
+    lo = self.find_edge(y, inside, lo_guess, -1)
+    hi = self.find_edge(y, inside, hi_guess, 1)
+    self.rows[y] = (lo, hi)
+    if self.reference is None or y > self.reference:
+      self.reference = y
+    return lo, hi
+
+  def row(self, y: int) -> Optional[Tuple[int, int]]:
+    """
+    Return the (first, last) x in the beam on row `y`, or None if it's
+    empty.
+
+    """
+    if y in self.rows:
+      return self.rows[y]
+
+    left, right = self.slopes()
+    lo_guess = round(left * y)
+    hi_guess = round(right * y)
+
+    # The middle of the predicted interval is usually in the beam. If not,
+    # search outwards from it, as far as past either predicted edge.
+    middle = (lo_guess + hi_guess) // 2
+    reach = max(middle - lo_guess, hi_guess - middle) + 2
+    for distance in range(reach + 1):
+      for inside in {middle - distance, middle + distance}:
+        if self.probe(inside, y):
+          return self.solve_row(y, inside, lo_guess, hi_guess)
+
+    self.rows[y] = None
+    return None
+
+  def fits(self, y: int, size: int) -> bool:
+    """
+    Return whether a square of `size` fits in the beam with its top on row
+    `y`, as far left as it can go.
+
+    """
+    top = self.row(y)
+    bottom = self.row(y + size - 1)
+    if top is None or bottom is None:
+      return False
+    x = bottom[0]
+    return x >= top[0] and x + size - 1 <= min(top[1], bottom[1])
+
+  def fit_square(self, size: int) -> Tuple[int, int]:
+    """
+    Return the top left (x, y) of the square of `size` closest to the
+    origin which fits entirely in the beam.
+
+    """
+    # The square fits once the right edge on its top row is `size` past
+    # the left edge on its bottom row. Estimate that row from the slopes,
+    # refining them on rows near it.
+    for _ in range(2):
+      left, right = self.slopes()
+      if right <= left:
+        raise ValueError("Beam doesn't widen")
+      estimate = max(math.ceil((size - 1) * (1 + left) / (right - left)), 0)
+      self.row(estimate)
+      self.row(estimate + size - 1)
+
+    # Gallop to bracket the first row the square fits on, then binary
+    # search.
+    if self.fits(estimate, size):
+      first_in = estimate
+      distance = 1
+      while True:
+        last_out = estimate - distance
+        if last_out < 0:
+          last_out = -1
+          break
+        if not self.fits(last_out, size):
+          break
+        first_in = last_out
+        distance *= 2
+    else:
+      last_out = estimate
+      distance = 1
+      while True:
+        first_in = estimate + distance
+        if self.fits(first_in, size):
+          break
+        last_out = first_in
+        distance *= 2
+
+    while first_in - last_out > 1:
+      mid = (first_in + last_out) // 2
+      if self.fits(mid, size):
+        first_in = mid
+      else:
+        last_out = mid
+
+    # Rounding the edges to whole cells means the square can fit on a few
+    # rows before the one found, then not fit again. Check them.
+    left, right = self.slopes()
+    window = math.ceil(3 / (right - left)) + 1
+    for y in range(max(first_in - window, 0), first_in):
+      if self.fits(y, size):
+        first_in = y
+        break
+
+    return self.row(first_in + size - 1)[0], first_in
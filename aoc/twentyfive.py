@@ -1,101 +1,109 @@
 import itertools
-import queue
 
-from . import async_computer
+from . import computer
 from . import utils
 
 
 def run_command(c, command, print_output=False):
-  for char in command:
-    c.send(ord(char))
-  c.send(ord("\n"))
-
-  arr = []
-  while True:
-    try:
-      arr.append(chr(c.get(timeout=0.1)))
-    except queue.Empty:
-      break
-
-  text = "".join(arr)
+  outputs, _ = c.run_until_blocked(ord(char) for char in command + "\n")
+
+  text = "".join(chr(x) for x in outputs)
   if "Unrecognized" in text or print_output:
     print(text)
 
   return text
 
 
+# Set of commands to pick up all the items and get to the security checkpoint.
+CHECKPOINT_COMMANDS = [
+  "west",
+  "north",
+  "take easter egg",
+  "south",
+  "take mug",
+  "east",
+  "south",
+  "east",
+  "north",
+  "take candy cane",
+  "south",
+  "west",
+  "north",
+  "east",
+  "north",
+  "north",
+  "take hypercube",
+  "south",
+  "east",
+  "take manifold",
+  "west",
+  "south",
+  "take coin",
+  "south",
+  "east",
+  "take pointer",
+  "west",
+  "west",
+  "take astrolabe",
+  "north",
+  "east",
+  "north"
+]
+
+ITEMS = [
+  "astrolabe",
+  "candy cane",
+  "coin",
+  "easter egg",
+  "hypercube",
+  "manifold",
+  "mug",
+  "pointer",
+]
+
+
+def manual_command(c, usr_input):
+  """
+  Run a command typed by the user, returning the computer to carry on with.
+
+  "!save <path>" and "!load <path>" save and restore the game to and from a
+  checkpoint file, so exploring can continue in a later session.
+
+  """
+  if usr_input.startswith("!save "):
+    c.save(usr_input[6:].strip())
+    return c, computer.State.NEEDS_INPUT
+
+  if usr_input.startswith("!load "):
+    c = computer.Computer.load(usr_input[6:].strip())
+    return c, computer.State.NEEDS_INPUT
+
+  outputs, state = c.run_until_blocked(ord(char) for char in usr_input + "\n")
+  print("".join(chr(x) for x in outputs))
+  return c, state
+
+
 def solve_a(inp):
-  c = async_computer.Computer()
+  c = computer.Computer()
   c.init_memory_from_string(inp)
-  c.run_async()
-
-  # Set of commands to pick up all the items and get to the security checkpoint.
-  commands = [
-    "west",
-    "north",
-    "take easter egg",
-    "south",
-    "take mug",
-    "east",
-    "south",
-    "east",
-    "north",
-    "take candy cane",
-    "south",
-    "west",
-    "north",
-    "east",
-    "north",
-    "north",
-    "take hypercube",
-    "south",
-    "east",
-    "take manifold",
-    "west",
-    "south",
-    "take coin",
-    "south",
-    "east",
-    "take pointer",
-    "west",
-    "west",
-    "take astrolabe",
-    "north",
-    "east",
-    "north"
-  ]
 
   # Get the initial output, and drop it.
-  while True:
-    try:
-      c.get(timeout=0.1)
-    except queue.Empty:
-      break
+  c.run_until_blocked()
 
   # Get to the security checkpoint.
-  for cmd in commands:
+  for cmd in CHECKPOINT_COMMANDS:
     run_command(c, cmd)
 
   print("At security checkpoint")
 
-  items = [
-    "astrolabe",
-    "candy cane",
-    "coin",
-    "easter egg",
-    "hypercube",
-    "manifold",
-    "mug",
-    "pointer",
-  ]
 
   # Drop all the items.
-  for item in items:
+  for item in ITEMS:
     run_command(c, f"drop {item}")
 
   # Try every combination of items.
-  for n in range(4, len(items)):
-    for comb in itertools.combinations(items, n):
+  for n in range(4, len(ITEMS)):
+    for comb in itertools.combinations(ITEMS, n):
       print(comb)
       for item in comb:
         run_command(c, f"take {item}")
@@ -114,23 +122,12 @@ def solve_a(inp):
         print("Passed security!")
         print(output)
 
-        while not c.finished_event.isSet():
+        _, state = c.run_until_blocked()
+        while state is computer.State.NEEDS_INPUT:
           # Drop into user input
-          arr = []
-          while True:
-            try:
-              arr.append(chr(c.get(timeout=0.1)))
-            except queue.Empty:
-              break
-
-          text = "".join(arr)
-          print(text)
-
-          usr_input = input()
-          for char in usr_input:
-            c.send(ord(char))
-          c.send(ord("\n"))
-        
+          c, state = manual_command(c, input())
+
+        return
 
 
 def solve_b(inp):
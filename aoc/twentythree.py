@@ -1,9 +1,11 @@
+import collections
 import dataclasses
 import queue
 import threading
-import time
 
 from . import async_computer
+from . import computer
+from . import program
 from . import utils
 
 
@@ -15,31 +17,108 @@ class Packet:
   y: int
 
 
+class Activity:
+  """
+  Tracks how many NICs are idle and how many packets are in flight.
+
+  A NIC is idle while it is blocked waiting for a packet. A packet is in
+  flight from when it is sent until it is read by a NIC or taken by the
+  NAT. The network is idle when every NIC is idle and nothing is in flight;
+  waiters on `condition` are woken whenever either count changes.
+
+  """
+  def __init__(self, num_endpoints):
+    self.num_endpoints = num_endpoints
+    self.condition = threading.Condition()
+    self.idle = 0
+    self.in_flight = 0
+
+  @property
+  def network_idle(self):
+    return self.idle == self.num_endpoints and self.in_flight == 0
+
+  def nic_idle(self):
+    with self.condition:
+      self.idle += 1
+      self.condition.notify_all()
+
+  def packet_sent(self):
+    with self.condition:
+      self.in_flight += 1
+
+  def packet_received(self, was_idle=False):
+    with self.condition:
+      self.in_flight -= 1
+      if was_idle:
+        self.idle -= 1
+      self.condition.notify_all()
+
+  def wait_until_idle(self, predicate=None):
+    """
+    Block until the network is idle and `predicate()`, if given, is true.
+
+    """
+    with self.condition:
+      self.condition.wait_for(
+        lambda: self.network_idle and (predicate is None or predicate()))
+
+
 class NIC(async_computer.Computer):
   # Replace the input and output instructions.
+  stepped = True
 
-  def __init__(self, addr, *args, **kwargs):
+  def __init__(self, addr, activity, *args, **kwargs):
     self.network_address = addr
+    self.activity = activity
     self.initialized = False
     self.packet = None
     self.output_dest = None
     self.output_x = None
-    self.num_no_packets = 0
+    # Whether the program was given -1 and has asked for input again
+    # without doing any output in between.
+    self.polled = False
     self.idle = False
     super().__init__(*args, **kwargs)
 
   @property
   def is_idle(self):
-    return self.input_queue.empty() and self.idle
+    return self.idle
+
+  def receive(self):
+    """
+    Take the next packet, blocking if the program has nothing else to do.
+
+    Returns None if there is no packet and the program should be given -1.
+
+    """
+    try:
+      packet = self.input_queue.get_nowait()
+    except queue.Empty:
+      if not self.polled:
+        self.polled = True
+        return None
+
+      # Nothing to do until a packet arrives.
+      self.idle = True
+      self.activity.nic_idle()
+      packet = self.input_queue.get()
+      self.idle = False
+      self.activity.packet_received(was_idle=True)
+    else:
+      self.activity.packet_received()
+
+    self.input_queue.task_done()
+    self.polled = False
+    return packet
 
   def step(self):
-    opdata = self.memory[self.ip]
-    op = async_computer.OPERATIONS[self.opdata_to_opcode(opdata)]
-    params = [self.memory[self.ip + i + 1] for i in range(op.params)]
+    inst = self.decoded.get(self.ip)
+    if inst is None:
+      inst = self.decode(self.ip)
 
-    #print(f"NIC {self.network_address} step, op {op.code}")
+    #print(f"NIC {self.network_address} step, op {inst.op.code}")
 
-    if op.code == 3:
+    if inst.op.code == 3:
       if not self.initialized:
         # Send in the network address
         val = self.network_address
@@ -50,42 +129,24 @@ class NIC(async_computer.Computer):
         val = self.packet.y
         self.packet = None
 
-      elif self.is_idle:
-        # Wait on an item on the queue to prevent further processing.
-        self.packet = self.input_queue.get()
-        self.num_no_packets = 0
-        self.idle = False
-        self.input_queue.task_done()
-        val = self.packet.x
-
       else:
-        # Try and get a value from the queue immediately.
-        try:
-          self.packet = self.input_queue.get_nowait()
-          self.num_no_packets = 0
-          self.idle = False
-          self.input_queue.task_done()
-          val = self.packet.x
-        except queue.Empty:
-          self.num_no_packets += 1
-          if self.num_no_packets > 100:
-            self.idle = True
-          val = -1
-
-      output_addr = self.get_param_val(opdata, 1, params[0], input_param=False)
-      self.memory[output_addr] = val
-      self.ip += 1 + op.params
-
-    elif op.code == 4:
+        self.packet = self.receive()
+        val = -1 if self.packet is None else self.packet.x
+
+      self.write(inst.modes[0], inst.params[0], val)
+      self.ip = inst.next_ip
+
+    elif inst.op.code == 4:
       # Output
-      self.idle = False
-      output_val = self.get_param_val(opdata, 1, params[0])
+      self.polled = False
+      output_val = self.read(inst.modes[0], inst.params[0])
 
       if self.output_dest is None:
         self.output_dest = output_val
       elif self.output_x is None:
         self.output_x = output_val
       else:
+        self.activity.packet_sent()
         self.output_queue.put(
           Packet(
             self.output_dest, self.network_address,
@@ -94,7 +155,7 @@ class NIC(async_computer.Computer):
         self.output_dest = None
         self.output_x = None
 
-      self.ip += 1 + op.params
+      self.ip = inst.next_ip
 
     else:
       super().step()
@@ -103,7 +164,8 @@ class NIC(async_computer.Computer):
 class Network:
   def __init__(self, num_endpoints, nic_intcode):
     self.fabric = queue.Queue()
-    self.nics = [NIC(addr, nic_intcode, output_queue=self.fabric)
+    self.activity = Activity(num_endpoints)
+    self.nics = [NIC(addr, self.activity, nic_intcode, output_queue=self.fabric)
                  for addr in range(num_endpoints)]
 
   def run(self):
@@ -111,8 +173,90 @@ class Network:
       nic.run_async()
 
 
+class SerialNetwork:
+  """
+  Network of NICs run in a single thread, in a fixed order.
+
+  Each round, every NIC is handed the packets waiting for it, or -1 if
+  there are none, and runs until it needs more input. Packets are routed
+  straight onto the queue of the NIC they are addressed to, so the run is
+  deterministic.
+
+  """
+  def __init__(self, num_endpoints, nic_intcode):
+    self.computers = [computer.Computer(nic_intcode)
+                      for _ in range(num_endpoints)]
+    # Packets waiting to be read by each NIC.
+    self.queues = [collections.deque() for _ in range(num_endpoints)]
+    # Values output by each NIC which don't yet make up a whole packet.
+    self.partial = [[] for _ in range(num_endpoints)]
+    self.rounds = 0
+
+    for addr, c in enumerate(self.computers):
+      self.run_nic(addr, [addr])
+
+  def send(self, packet):
+    self.queues[packet.dest].append(packet)
+
+  def run_nic(self, addr, inputs):
+    """
+    Run a NIC until it needs more input, returning the packets it sent.
+
+    """
+    outputs, _ = self.computers[addr].run_until_blocked(inputs)
+    partial = self.partial[addr]
+    partial.extend(outputs)
+
+    packets = []
+    while len(partial) >= 3:
+      dest, x, y = partial[:3]
+      del partial[:3]
+      packets.append(Packet(dest, addr, x, y))
+    return packets
+
+  def packets(self):
+    """
+    Run the network, yielding each packet addressed outside it.
+
+    Yields None whenever the network is idle: every NIC is waiting for
+    input, with no packets queued and no packet half sent.
+
+    """
+    num_endpoints = len(self.computers)
+    while True:
+      self.rounds += 1
+      sent = False
+      for addr in range(num_endpoints):
+        waiting = self.queues[addr]
+        inputs = [-1]
+        if waiting:
+          inputs = [value for packet in waiting
+                    for value in (packet.x, packet.y)]
+          waiting.clear()
+
+        for packet in self.run_nic(addr, inputs):
+          sent = True
+          if 0 <= packet.dest < num_endpoints:
+            self.send(packet)
+          else:
+            yield packet
+
+      if not sent and not any(self.queues) and not any(self.partial):
+        yield None
+
+
 def solve_a(inp):
-  intcode = [int(x) for x in inp.split(",")]
+  intcode = program.load_program(inp)
+
+  net = SerialNetwork(50, intcode)
+  for packet in net.packets():
+    if packet is not None and packet.dest == 255:
+      print(packet)
+      return
+
+
+def solve_a_threaded(inp):
+  intcode = program.load_program(inp)
 
   net = Network(50, intcode)
   net.run()
@@ -140,22 +284,29 @@ class NATNetwork(Network):
     self.nat_history = [Packet(-1, -1, -99999, -99999)]
     self.nat_finished = threading.Event()
 
+  def receive_nat_packet(self, packet):
+    self.nat_packet = packet
+    self.activity.packet_received()
+
   def run_nat(self):
     while True:
-      if all(nic.is_idle for nic in self.nics) and self.nat_packet is not None:
-        self.nics[0].send(self.nat_packet)
-        print(f"Sent NAT packet {self.nat_packet}")
-
-        if self.nat_packet.y == self.nat_history[-1].y:
-          print("###############")
-          print(f"y = {self.nat_packet.y}")
-          print("###############")
-          self.nat_finished.set()
-          return
-
-        self.nat_history.append(self.nat_packet)
-
-      time.sleep(0.2)
+      # Wakes as soon as the last NIC blocks with nothing in flight.
+      self.activity.wait_until_idle(lambda: self.nat_packet is not None)
+      self.activity.packet_sent()
+      self.nics[0].send(self.nat_packet)
+      print(f"Sent NAT packet {self.nat_packet}")
+
+      if self.nat_packet.y == self.nat_history[-1].y:
+        print("###############")
+        print(f"y = {self.nat_packet.y}")
+        print("###############")
+        self.nat_finished.set()
+        # Wake the router, which may be waiting on a network with nothing
+        # left to send.
+        self.fabric.put(None)
+        return
+
+      self.nat_history.append(self.nat_packet)
 
   def run_nat_async(self):
     run_thread = threading.Thread(target=self.run_nat)
@@ -163,7 +314,29 @@ class NATNetwork(Network):
   
 
 def solve_b(inp):
-  intcode = [int(x) for x in inp.split(",")]
+  intcode = program.load_program(inp)
+
+  net = SerialNetwork(50, intcode)
+  nat_packet = None
+  last_y = None
+  for packet in net.packets():
+    if packet is not None:
+      if packet.dest == 255:
+        nat_packet = packet
+      continue
+
+    # The network is idle; the NAT wakes it up.
+    if nat_packet is None:
+      raise RuntimeError("Network idle with no NAT packet")
+    net.send(dataclasses.replace(nat_packet, dest=0, src=255))
+    if nat_packet.y == last_y:
+      print(f"y = {nat_packet.y}")
+      return
+    last_y = nat_packet.y
+
+
+def solve_b_threaded(inp):
+  intcode = program.load_program(inp)
 
   net = NATNetwork(50, intcode)
   net.run()
@@ -171,9 +344,11 @@ def solve_b(inp):
 
   while not net.nat_finished.isSet():
     packet = net.fabric.get()
+    if packet is None:
+      break
     print(f"Got packet: {packet}")
     if packet.dest == 255:
-      net.nat_packet = packet
+      net.receive_nat_packet(packet)
       continue
 
     try:
@@ -1,5 +1,10 @@
 import itertools
+from typing import *
 
+import numpy
+
+from . import computer
+from . import lockstep
 from . import utils
 
 
@@ -11,6 +16,14 @@ class ProgramFinished(Exception):
   pass
 
 
+class SymbolicAddress(Exception):
+  """
+  Exception raised when an op code or address depends on the unknowns.
+
+  """
+  pass
+
+
 class IntComputer:
   """
   Computer that processes IntCode.
@@ -57,6 +70,226 @@ class IntComputer:
       print(str(e))
 
 
+class Polynomial:
+  """
+  Polynomial with integer coefficients in a fixed number of unknowns.
+
+  Terms are held as a dict from each monomial, given as a tuple of the
+  power of each unknown, to its coefficient.
+
+  """
+  def __init__(self, terms: Dict[Tuple[int, ...], int], num_unknowns: int):
+    self.terms = {m: c for m, c in terms.items() if c != 0}
+    self.num_unknowns = num_unknowns
+
+  @classmethod
+  def constant(cls, value: int, num_unknowns: int) -> "Polynomial":
+    return cls({(0,) * num_unknowns: value}, num_unknowns)
+
+  @classmethod
+  def unknown(cls, index: int, num_unknowns: int) -> "Polynomial":
+    powers = [0] * num_unknowns
+    powers[index] = 1
+    return cls({tuple(powers): 1}, num_unknowns)
+
+  @property
+  def is_constant(self) -> bool:
+    return all(not any(m) for m in self.terms)
+
+  @property
+  def value(self) -> int:
+    """
+    The value of a constant polynomial.
+
+    """
+    return self.terms.get((0,) * self.num_unknowns, 0)
+
+  def __add__(self, other: "Polynomial") -> "Polynomial":
+    terms = dict(self.terms)
+    for m, c in other.terms.items():
+      terms[m] = terms.get(m, 0) + c
+    return Polynomial(terms, self.num_unknowns)
+
+  def __mul__(self, other: "Polynomial") -> "Polynomial":
+    terms = {}
+    for (m1, c1), (m2, c2) in itertools.product(
+        self.terms.items(), other.terms.items()):
+      m = tuple(p1 + p2 for p1, p2 in zip(m1, m2))
+      terms[m] = terms.get(m, 0) + c1 * c2
+    return Polynomial(terms, self.num_unknowns)
+
+  def substitute(self, index: int, value: int) -> "Polynomial":
+    """
+    Return the polynomial with unknown `index` replaced by `value`.
+
+    """
+    terms = {}
+    for m, c in self.terms.items():
+      reduced = m[:index] + (0,) + m[index + 1:]
+      terms[reduced] = terms.get(reduced, 0) + c * value ** m[index]
+    return Polynomial(terms, self.num_unknowns)
+
+  def coefficients(self, index: int) -> List[int]:
+    """
+    Coefficients by power of unknown `index`, for a polynomial in only it.
+
+    """
+    coefficients = [0] * (max((m[index] for m in self.terms), default=0) + 1)
+    for m, c in self.terms.items():
+      coefficients[m[index]] += c
+    return coefficients
+
+  def __str__(self):
+    names = "xyzw"
+    parts = []
+    for m, c in sorted(self.terms.items(), reverse=True):
+      factors = [
+        names[i] if p == 1 else "{}^{}".format(names[i], p)
+        for i, p in enumerate(m) if p]
+      if c != 1 or not factors:
+        factors.insert(0, str(c))
+      parts.append("*".join(factors))
+    return " + ".join(parts) or "0"
+
+
+class SymbolicComputer(IntComputer):
+  """
+  Computer that runs IntCode with some cells holding unknown values.
+
+  Every cell holds a `Polynomial` in the unknowns, so after a run each cell
+  holds its final value as a function of them. A value read through an
+  address which depends on the unknowns can't be known, so is held as None.
+  Op codes and write addresses must be known; `SymbolicAddress` is raised
+  if they aren't.
+
+  """
+  def __init__(self, unknowns: Sequence[int]):
+    super().__init__()
+    # Addresses of the cells holding the unknowns.
+    self.unknowns = unknowns
+
+  def load_intcode(self, intcode):
+    n = len(self.unknowns)
+    self.intcode = [Polynomial.constant(value, n) for value in intcode]
+    for i, addr in enumerate(self.unknowns):
+      self.intcode[addr] = Polynomial.unknown(i, n)
+
+  def concrete(self, addr: int) -> int:
+    cell = self.intcode[addr]
+    if cell is None or not cell.is_constant:
+      raise SymbolicAddress("Cell {} is {}".format(addr, cell))
+    return cell.value
+
+  def read(self, addr: int) -> Optional[Polynomial]:
+    """
+    Read the cell whose address is held in cell `addr`.
+
+    """
+    cell = self.intcode[addr]
+    if cell is None or not cell.is_constant:
+      return None
+    return self.intcode[cell.value]
+
+  def step(self, start):
+    op = self.concrete(start)
+
+    if op == 1 or op == 2:
+      a = self.read(start + 1)
+      b = self.read(start + 2)
+      dest = self.concrete(start + 3)
+      if a is None or b is None:
+        self.intcode[dest] = None
+      elif op == 1:
+        self.intcode[dest] = a + b
+      else:
+        self.intcode[dest] = a * b
+
+    elif op == 99:
+      raise ProgramFinished()
+
+    else:
+      raise OpCodeError("Invalid op code: {}".format(op))
+
+
+def solve_polynomial(poly: Polynomial, target: int, size: int = 100):
+  """
+  Find the first (noun, verb), each below `size`, with `poly` equal to
+  `target`, where `poly` is in the unknowns (noun, verb).
+
+  """
+  for noun in range(size):
+    coefficients = poly.substitute(0, noun).coefficients(1)
+    if len(coefficients) <= 2:
+      # Linear in the verb, so solve for it directly.
+      c0, c1 = (coefficients + [0])[:2]
+      if c1 == 0:
+        if c0 == target:
+          return noun, 0
+      elif (target - c0) % c1 == 0 and 0 <= (target - c0) // c1 < size:
+        return noun, (target - c0) // c1
+      continue
+
+    for verb in range(size):
+      value = 0
+      for c in reversed(coefficients):
+        value = value * verb + c
+      if value == target:
+        return noun, verb
+
+  return None
+
+
+def solve_batched(intcode, target, size: int = 100):
+  """
+  Find (noun, verb) by running the program for every verb at once.
+
+  """
+  verbs = numpy.arange(size)
+  for noun in range(size):
+    c = lockstep.LockstepComputer(intcode, [()] * size)
+    c.memory[:, 1] = noun
+    c.memory[:, 2] = verbs
+    try:
+      c.run()
+      results = c.memory[:, 0].tolist()
+    except computer.ComputerError:
+      # Some verb makes the program fail; run each on its own.
+      results = []
+      for verb in verbs.tolist():
+        single = IntComputer()
+        single.load_intcode(intcode[:1] + [noun, verb] + intcode[3:])
+        single.run()
+        results.append(single.intcode[0])
+
+    if target in results:
+      return noun, results.index(target)
+
+  return None
+
+
+def find_noun_verb(intcode, target):
+  """
+  Find the first (noun, verb) for which the program leaves `target` in
+  address 0.
+
+  The program is run once with the noun and verb unknown, giving address 0
+  as a polynomial in them to solve. If that can't be found because the
+  program's control flow or addressing depends on them, the program is run
+  concretely instead.
+
+  """
+  c = SymbolicComputer((1, 2))
+  c.load_intcode(intcode)
+  try:
+    c.run()
+  except (SymbolicAddress, IndexError):
+    return solve_batched(intcode, target)
+
+  if c.intcode[0] is None:
+    return solve_batched(intcode, target)
+  return solve_polynomial(c.intcode[0], target)
+
+
 def solve_a(inp):
   intcode = [int(x) for x in inp.split(",")]
   intcode[1] = 12
@@ -70,20 +303,15 @@ def solve_a(inp):
 
 def solve_b(inp, target):
   intcode = [int(x) for x in inp.split(",")]
-  
-  c = IntComputer()
 
-  for noun in range(100):
-    for verb in range(100):
-      intcode[1] = noun
-      intcode[2] = verb
+  solution = find_noun_verb(intcode, target)
+  if solution is None:
+    print("No solution")
+    return
 
-      c.load_intcode(intcode)
-      c.run()
-      
-      if c.intcode[0] == target:
-        print(f"Solution: {noun}, {verb}")
-        print(100 * noun + verb)
+  noun, verb = solution
+  print(f"Solution: {noun}, {verb}")
+  print(100 * noun + verb)
 
 
 def run():